@@ -0,0 +1,236 @@
+import contextlib
+import csv
+import io
+import json
+import os
+import pickle
+import platform
+import tracemalloc
+import numpy as np
+import networkx as nx
+import GraphBuild
+from CoherenceLoader import START, STOP, iter_band_matrices
+from GraphBuild import Wavelength, build_graph_from_row, save_metadata, save_subject_state_graphs, threshold
+from GraphMetrics import GraphMetrics
+from Instrumentation import Profiler
+from SignificanceTester import SignificanceTester
+
+STATES = ('rest', 'film')
+
+
+def write_synthetic_csv(filename, num_electrodes, num_bands=len(Wavelength), rng=None, start=START, stop=STOP):
+    """
+    Writes a synthetic coherence CSV in the flattened layout of the recordings: a header row, then one row
+    per wavelength holding its name, the STOP diagonal of the first electrode, and from column `start` on
+    the upper triangle of a random symmetric coherence matrix, every matrix row closed by STOP.
+    The coherences are drawn in [0.05, 0.95) so none of them can be mistaken for the sentinel.
+    """
+    if num_bands > len(Wavelength):
+        raise ValueError(f"At most {len(Wavelength)} bands are supported, got {num_bands}")
+    rng = rng or np.random.default_rng()
+    rows = []
+    for wavelength in list(Wavelength)[:num_bands]:
+        values = []
+        for i in range(num_electrodes):
+            values.append(stop)
+            values.extend(rng.uniform(0.05, 0.95, num_electrodes - i - 1).tolist())
+        # Column 1 holds the diagonal of the first electrode, the data starts at `start`
+        rows.append([wavelength.name] + [''] * (start - 2) + [repr(value) for value in values])
+
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([''] + list(range(len(rows[0]) - 1)))
+        writer.writerows(rows)
+
+
+def generate_dataset(directory, num_electrodes=64, num_bands=len(Wavelength), num_subjects=10, states=STATES,
+                     seed=0):
+    """
+    Writes a synthetic coherence CSV for every subject and state in `directory`, named like the recordings
+    ({base}{subject}_{state}_coherence.csv). Every file gets its own seed spawned from `seed`, so the
+    dataset does not depend on the order the files are written in.
+    Returns the CSV address base, the subjects and the states.
+    """
+    os.makedirs(directory, exist_ok=True)
+    csv_address_base = os.path.join(directory, 'flatten_sub_')
+    subjects = [f"{i + 1:02d}" for i in range(num_subjects)]
+    pairs = [(subject, state) for subject in subjects for state in states]
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    for (subject, state), file_seed in zip(pairs, seeds):
+        write_synthetic_csv(f"{csv_address_base}{subject}_{state}_coherence.csv", num_electrodes, num_bands,
+                            np.random.default_rng(file_seed))
+    return csv_address_base, subjects, list(states)
+
+
+def stage_results(records):
+    """
+    Summarizes the Profiler records of the runs of one stage: wall and CPU time of every run, best and mean
+    wall time, and the highest peak memory when it was tracked.
+    """
+    wall_times = [record['Wall_Seconds'] for record in records]
+    peaks = [record['Peak_Memory_Bytes'] for record in records if record['Peak_Memory_Bytes'] is not None]
+    return {
+        'wall_seconds': wall_times,
+        'cpu_seconds': [record['CPU_Seconds'] for record in records],
+        'best_wall_seconds': min(wall_times),
+        'mean_wall_seconds': float(np.mean(wall_times)),
+        'peak_memory_bytes': max(peaks) if peaks else None,
+    }
+
+
+def run_benchmark(num_electrodes=64, num_bands=len(Wavelength), num_subjects=10, states=STATES, repeats=1,
+                  seed=0, work_directory='benchmark_data', output_file='benchmark_results.json',
+                  track_memory=True, graph_metrics_options=None):
+    """
+    Benchmarks the build -> metrics -> stats stages on a synthetic dataset of `num_subjects` subjects with
+    `num_electrodes` electrodes and `num_bands` bands per recording:
+    - parse_csv: streaming every coherence matrix out of the CSVs.
+    - build_graph_from_row / threshold: the row by row graph builder and the thresholding of its graphs.
+    - build_graphs: the vectorized build of every (subject, state), written to GraphML like save_graphs.
+    - global_metrics / node_metrics: GraphMetrics.calculate_global_metrics / calculate_node_metrics.
+    - stats_batch / stats_paired / stats_node: SignificanceTester.compare_global_metrics_batch,
+      compare_global_metrics and compare_node_metrics between the first two states.
+    Every stage is timed (wall and CPU) `repeats` times by an Instrumentation.Profiler. With track_memory, its
+    memory high-water mark is measured in one more run of its own, so tracemalloc does not slow down the
+    timed runs. The printed output of the stages is swallowed.
+    The results are written to `output_file` as JSON, with the parameters and the library versions, so
+    runs of different versions can be compared with compare_benchmarks.
+    """
+    csv_address_base, subjects, states = generate_dataset(work_directory, num_electrodes, num_bands,
+                                                          num_subjects, states, seed)
+    csv_files = [f"{csv_address_base}{subject}_{state}_coherence.csv" for subject in subjects for state in states]
+    graphml_directory = os.path.join(work_directory, 'graphml')
+    os.makedirs(graphml_directory, exist_ok=True)
+    stages = {}
+    profiler = Profiler()
+    memory_profiler = Profiler(track_memory=True)
+    was_tracing = tracemalloc.is_tracing()
+
+    def run(name, stage):
+        result = None
+        for _ in range(repeats):
+            with profiler.measure(name), contextlib.redirect_stdout(io.StringIO()):
+                result = stage()
+        stages[name] = stage_results([record for record in profiler.records if record['Stage'] == name])
+
+        if track_memory:
+            with memory_profiler.measure(name), contextlib.redirect_stdout(io.StringIO()):
+                stage()
+            stages[name]['peak_memory_bytes'] = memory_profiler.records[-1]['Peak_Memory_Bytes']
+            # The profiler starts tracemalloc; stop it before the next timed runs unless it was already running
+            if not was_tracing:
+                tracemalloc.stop()
+
+        print(f"{name}: {stages[name]['best_wall_seconds']:.4f} s")
+        return result
+
+    run('parse_csv', lambda: [matrix for csv_file in csv_files for _, matrix in iter_band_matrices(csv_file)])
+
+    def read_rows():
+        rows = []
+        for csv_file in csv_files:
+            with open(csv_file, 'r') as file:
+                reader = csv.reader(file)
+                next(reader)  # Skip header row
+                rows.extend(reader)
+        return rows
+
+    rows = read_rows()
+    graphs = run('build_graph_from_row', lambda: [build_graph_from_row(row) for row in rows])
+    run('threshold', lambda: [threshold(graph) for graph in graphs])
+
+    def build_graphs():
+        metadata = {}
+        for subject in subjects:
+            for state in states:
+                for wavelength_name, graph_file in save_subject_state_graphs(subject, state, csv_address_base,
+                                                                             graphml_directory):
+                    metadata[(subject, state, Wavelength[wavelength_name])] = graph_file
+        return metadata
+
+    metadata = run('build_graphs', build_graphs)
+    metadata_file = os.path.join(work_directory, 'graph_metadata.pkl')
+    save_metadata(metadata, metadata_file)
+
+    # The graphs are loaded once, so the metric stages only time the metrics
+    options = dict({'partitions_file': os.path.join(work_directory, 'graph_partitions.pkl')},
+                   **(graph_metrics_options or {}))
+    graph_metrics = GraphMetrics(metadata_file, **options)
+    loaded = {key: nx.read_graphml(graph_file) for key, graph_file in metadata.items()}
+
+    def calculate(calculate_metrics):
+        results = {}
+        for key, graph in loaded.items():
+            graph_metrics.current_key = key
+            results[key] = calculate_metrics(graph)
+        return results
+
+    global_metrics = run('global_metrics', lambda: calculate(graph_metrics.calculate_global_metrics))
+    node_metrics = run('node_metrics', lambda: calculate(graph_metrics.calculate_node_metrics))
+
+    metrics_file = os.path.join(work_directory, 'graph_metrics.pkl')
+    with open(metrics_file, 'wb') as file:
+        pickle.dump({key: {'global_metrics': global_metrics[key], 'node_metrics': node_metrics[key]}
+                     for key in metadata}, file)
+
+    if len(states) >= 2:
+        tester = SignificanceTester(metrics_file)
+        run('stats_batch', lambda: tester.compare_global_metrics_batch(states[0], states[1]))
+        run('stats_paired', lambda: tester.compare_global_metrics(states[0], states[1]))
+        run('stats_node', lambda: tester.compare_node_metrics(states[0], states[1]))
+
+    results = {
+        'parameters': {
+            'num_electrodes': num_electrodes,
+            'num_bands': num_bands,
+            'num_subjects': num_subjects,
+            'states': states,
+            'repeats': repeats,
+            'seed': seed,
+            'track_memory': track_memory,
+            'num_graphs': len(metadata),
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'networkx': nx.__version__,
+        },
+        'stages': stages,
+    }
+    if output_file is not None:
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+def compare_benchmarks(baseline_file, results_file, tolerance=0.2):
+    """
+    Compares two benchmark result files stage by stage.
+    A stage regresses when its best wall time or its peak memory grew by more than `tolerance` (a
+    fraction) over the baseline. Returns a list of the regressions, empty when there are none.
+    """
+    with open(baseline_file, 'r') as file:
+        baseline = json.load(file)
+    with open(results_file, 'r') as file:
+        results = json.load(file)
+    if baseline['parameters'] != results['parameters']:
+        print("Warning: the benchmarks were run with different parameters")
+
+    regressions = []
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        for measurement in ('best_wall_seconds', 'peak_memory_bytes'):
+            before, after = reference.get(measurement), stage.get(measurement)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append({'stage': name, 'measurement': measurement, 'baseline': before,
+                                    'current': after, 'ratio': after / before})
+    return regressions
+
+
+if __name__ == "__main__":
+    # Scale close to the recordings: 64 electrodes, 6 bands, the subjects of GraphBuild
+    run_benchmark(num_electrodes=64, num_bands=len(Wavelength), num_subjects=len(GraphBuild.subjects))
+    print("Benchmark results saved to benchmark_results.json")
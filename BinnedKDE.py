@@ -0,0 +1,116 @@
+import hashlib
+import os
+import pickle
+import numpy as np
+from shared import Wavelength
+
+GRID_SIZE = 512
+HIST_BINS = 50
+CUT = 3  # The curves extend this many bandwidths past the data, like sns.kdeplot
+
+
+def scott_bandwidth(values):
+    """
+    Scott's rule of thumb bandwidth, n^(-1/5) times the standard deviation, like scipy and seaborn.
+    """
+    return values.size ** (-1 / 5) * values.std(ddof=1)
+
+
+def linear_binning(values, lower, upper, grid_size):
+    """
+    Spreads every value over its two nearest points of a regular grid, in proportion to its distance to them.
+    Returns the weight of every grid point (they sum to the number of values).
+    """
+    delta = (upper - lower) / (grid_size - 1)
+    position = (values - lower) / delta
+    left = np.clip(np.floor(position).astype(np.int64), 0, grid_size - 2)
+    fraction = position - left
+    return (np.bincount(left, weights=1 - fraction, minlength=grid_size) +
+            np.bincount(left + 1, weights=fraction, minlength=grid_size))
+
+
+def binned_kde(values, grid_size=GRID_SIZE, bandwidth=None, cut=CUT):
+    """
+    Gaussian kernel density estimate of the values on a regular grid: the values are linearly binned on the
+    grid and the bin weights are convolved with the Gaussian kernel with an FFT, so the cost does not grow
+    with the number of values times the number of grid points like an exact KDE.
+    Returns the grid and the density on it. Without at least two distinct values the density is all zeros.
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size < 2 or values.std() == 0:
+        center = values[0] if values.size else 0.0
+        return np.linspace(center - 1, center + 1, grid_size), np.zeros(grid_size)
+
+    bandwidth = bandwidth or scott_bandwidth(values)
+    lower, upper = values.min() - cut * bandwidth, values.max() + cut * bandwidth
+    grid = np.linspace(lower, upper, grid_size)
+    weights = linear_binning(values, lower, upper, grid_size)
+
+    # Gaussian kernel at every grid offset, then a linear (zero-padded) convolution through the FFT
+    delta = grid[1] - grid[0]
+    offsets = np.arange(-(grid_size - 1), grid_size) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (np.sqrt(2 * np.pi) * bandwidth)
+    size = 1 << int(np.ceil(np.log2(weights.size + kernel.size - 1)))
+    convolution = np.fft.irfft(np.fft.rfft(weights, size) * np.fft.rfft(kernel, size), size)
+    density = np.maximum(convolution[grid_size - 1:2 * grid_size - 1], 0.0) / values.size
+    return grid, density
+
+
+def distribution(values, grid_size=GRID_SIZE, hist_bins=HIST_BINS):
+    """
+    Precomputes the histogram and the binned KDE of a set of values.
+    """
+    values = np.asarray(values, dtype=float)
+    finite = values[np.isfinite(values)]
+    grid, density = binned_kde(finite, grid_size)
+    if finite.size:
+        counts, edges = np.histogram(finite, bins=hist_bins)
+    else:
+        counts, edges = np.zeros(hist_bins, dtype=np.int64), np.zeros(hist_bins + 1)
+    return {
+        'n': int(finite.size),
+        'grid': grid,
+        'density': density,
+        'hist_counts': counts,
+        'hist_edges': edges,
+    }
+
+
+def node_metric_distributions(table, metric_name, cache_directory='kde_cache', grid_size=GRID_SIZE,
+                              hist_bins=HIST_BINS):
+    """
+    Precomputes the histogram and binned KDE of a node-level metric for every (wavelength, state), straight
+    from the value slices of a MetricsTable.
+    The results are cached in `cache_directory` with a hash of the values they were computed from, so only
+    the (wavelength, state) groups whose values changed are recomputed.
+    Returns a dictionary mapping (wavelength name, state) to its distribution.
+    """
+    cache_file = None
+    cache = {}
+    if cache_directory is not None:
+        os.makedirs(cache_directory, exist_ok=True)
+        cache_file = os.path.join(cache_directory, f"{metric_name}_{grid_size}_{hist_bins}.pkl")
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rb') as file:
+                cache = pickle.load(file)
+
+    distributions = {}
+    updated = False
+    for kind, group_metric, state_code, wavelength_value in sorted(table.groups):
+        if kind != 'node' or group_metric != metric_name:
+            continue
+        state = table.states[state_code]
+        key = (Wavelength(wavelength_value).name, state)
+        values = np.ascontiguousarray(table.query_node(metric_name, state, wavelength_value)['value'])
+        digest = hashlib.sha256(values.tobytes()).hexdigest()
+
+        if key not in cache or cache[key]['digest'] != digest:
+            cache[key] = dict(distribution(values, grid_size, hist_bins), digest=digest)
+            updated = True
+        distributions[key] = cache[key]
+
+    if cache_file is not None and updated:
+        with open(cache_file, 'wb') as file:
+            pickle.dump(cache, file)
+    return distributions
@@ -1,7 +1,9 @@
 import csv
 import networkx as nx
-import matplotlib.pyplot as plt
 import numpy as np
+from CoherenceLoader import iter_band_matrices, matrix_to_graph
+from EdgeThreshold import threshold_graph
+from FigureRenderer import finish_figure, prepare_axes
 
 # the stop value in the matrix
 STOP = 1.0
@@ -21,7 +23,12 @@ from scipy import stats
 # import seaborn as sns
 
 
-def build_graph_from_csv(csv_file):
+def build_graph_from_csv(csv_file, backend="numpy"):
+    # the numpy backend only parses the first row, which is the first wavelength
+    if backend == "numpy":
+        _, matrix = next(iter_band_matrices(csv_file, START, STOP))
+        return matrix_to_graph(matrix)
+
     # Create a graph
     G = nx.Graph()
 
@@ -67,20 +74,8 @@ def build_graph_from_csv(csv_file):
 
 
 def threshold(G):
-    # sort the edges
-    sorted_edges = sorted(G.edges(data=True), key=lambda x: x[2]['weight'], reverse=True)
-    # number of edges to keep
-    num_edges_to_keep = int(len(sorted_edges) * TOP)
-    # take the top (TOP)% the largest edges
-    top_edges = sorted_edges[:num_edges_to_keep]
-    # create the new graph with only the top edges
-    G_top = nx.Graph()
-
-    for edge in top_edges:
-        G_top.add_node(edge[0])
-        G_top.add_node(edge[1])
-    G_top.add_edges_from(top_edges)
-    return G_top
+    # keep the top (TOP)% largest edges, argpartition instead of sorting every edge
+    return threshold_graph(G, TOP)
 
 
 def CC(G):
@@ -102,46 +97,49 @@ def GCC(G):
     return global_clustering_coefficient
 
 
-# Visualize the graph
-def visualize(G):
-    nx.draw(G, with_labels=True)
-    plt.show()
+# Visualize the graph, or save it to save_path in headless mode (a figure passed in is reused)
+def visualize(G, save_path=None, fig=None):
+    reused = fig is not None
+    fig, ax = prepare_axes(fig, (6.4, 4.8))
+    nx.draw(G, with_labels=True, ax=ax)
+    finish_figure(fig, save_path, reused)
 
 def save_graph_to_graphml(graph, filename):
     """Saves the graph in GraphML format."""
     nx.write_graphml(graph, filename)
 
 
-rest_or_film = "film"
-csv_file = (
-    "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands)/FC_matrix_by_frequncy_bands"
-    "/flatten_sub_03_" + rest_or_film + "_coherence.csv")
+if __name__ == "__main__":
+    rest_or_film = "film"
+    csv_file = (
+        "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands)/FC_matrix_by_frequncy_bands"
+        "/flatten_sub_03_" + rest_or_film + "_coherence.csv")
 
-graph = build_graph_from_csv(csv_file)
-graph_top = threshold(graph)
-# CC(graph_top)
-GCC_1 = GCC(graph_top)
-visualize(graph_top)
+    graph = build_graph_from_csv(csv_file)
+    graph_top = threshold(graph)
+    # CC(graph_top)
+    GCC_1 = GCC(graph_top)
+    visualize(graph_top)
 
-rest_or_film = "rest"
-csv_file = (
-    "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands)/FC_matrix_by_frequncy_bands"
-    "/flatten_sub_03_" + rest_or_film + "_coherence.csv")
+    rest_or_film = "rest"
+    csv_file = (
+        "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands)/FC_matrix_by_frequncy_bands"
+        "/flatten_sub_03_" + rest_or_film + "_coherence.csv")
 
-graph = build_graph_from_csv(csv_file)
-graph_top = threshold(graph)
-# CC(graph_top)
-GCC_2 = GCC(graph_top)
+    graph = build_graph_from_csv(csv_file)
+    graph_top = threshold(graph)
+    # CC(graph_top)
+    GCC_2 = GCC(graph_top)
 
-save_graph_to_graphml(graph_top, 'saved_graph.graphml')
+    save_graph_to_graphml(graph_top, 'saved_graph.graphml')
 
-t_statistic, p_value = stats.ttest_ind(GCC_1, GCC_2)
+    t_statistic, p_value = stats.ttest_ind(GCC_1, GCC_2)
 
-alpha = 0.05
+    alpha = 0.05
 
-if p_value < alpha:
-    print("significant")
-elif p_value >= alpha:
-    print("not significant")
-else:
-    print("error while calculating")
+    if p_value < alpha:
+        print("significant")
+    elif p_value >= alpha:
+        print("not significant")
+    else:
+        print("error while calculating")
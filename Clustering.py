@@ -7,38 +7,54 @@ from sklearn import preprocessing
 import itertools
 import seaborn as sns
 import matplotlib.pyplot as plt
-import csv
 import os
 import statistics
+from CoherenceCache import CoherenceCache
+from CoherenceLoader import parse_values
+from StreamingStats import RunningStats
 
 file_path = "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands)/FC_matrix_by_frequncy_bands/flatten_sub_02_film_coherence.csv"
 
 
 def mean_calc(file_path):
-    # Read the values from the CSV file and calculate the mean
-    values = []
+    # Stream the values from the CSV file and keep a running mean, one row in memory at a time
+    running = RunningStats()
 
     with open(file_path, 'r') as csv_file:
-        csv_reader = csv.reader(csv_file)
-
         # Skip the header row if it exists
-        next(csv_reader, None)
-
-        i = 2
-        for row in csv_reader:
-            for value in row[i:]:
-                try:
-                    numeric_value = float(value)
-                    values.append(numeric_value)
-                except ValueError:
-                    pass
-            i = i + 1
-
-    # Calculate the mean of the values
-    mean_value = statistics.mean(values)
+        next(csv_file, None)
+
+        # Every row contributes its values from column i on, and i moves one column per row
+        for i, line in enumerate(csv_file, start=2):
+            cells = line.rstrip('\r\n').split(',', i)
+            if len(cells) > i:
+                running.update(parse_values(cells[i]))
+
+    # Calculate the mean of the values, which like statistics.mean needs at least one of them
+    if running.count == 0:
+        raise statistics.StatisticsError('mean requires at least one data point')
+    mean_value = running.mean
+    print(f"Mean value: {mean_value}")
+
+    return mean_value
+
+
+def mean_calc_cached(cache_directory, subject, state):
+    # Same mean as mean_calc, with the rows sliced from a coherence cache instead of parsing the CSV
+    cache = CoherenceCache(cache_directory)
+    running = RunningStats()
+
+    # Row i of the file contributes its values from column i + 2 on, so the first i values of its band are left out
+    for i in range(len(cache.bands)):
+        running.update(cache.flattened_row(subject, state, i)[i:])
+
+    if running.count == 0:
+        raise statistics.StatisticsError('mean requires at least one data point')
+    mean_value = running.mean
     print(f"Mean value: {mean_value}")
 
     return mean_value
 
 
-mean_calc(file_path)
\ No newline at end of file
+if __name__ == "__main__":
+    mean_calc(file_path)
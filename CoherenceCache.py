@@ -0,0 +1,179 @@
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from CoherenceLoader import START, STOP, iter_coherence_rows, row_to_upper_triangle, upper_triangle_to_matrix
+
+TENSOR_FILE = 'coherence.npy'
+MANIFEST_FILE = 'manifest.json'
+
+
+def csv_filename(csv_address_base, subject, state):
+    """Returns the path of the flattened coherence CSV of a subject and state."""
+    return f"{csv_address_base}{subject}_{state}_coherence.csv"
+
+
+def _electrode_count(csv_file, start=START, stop=STOP):
+    """
+    Reads only the first band of a CSV and returns its electrode count, or 0 if the file is missing or empty.
+    """
+    if not os.path.exists(csv_file):
+        return 0
+    for _, values in iter_coherence_rows(csv_file, start):
+        return row_to_upper_triangle(values, stop)[1]
+    return 0
+
+
+def _band_names(csv_file, start=START):
+    """Returns the names of the bands (first column) of a CSV."""
+    return [band for band, _ in iter_coherence_rows(csv_file, start)]
+
+
+def _fill_tensor(tensor_path, position, csv_file, start, stop):
+    """
+    Parses one CSV and writes the upper triangle of every band into its slot of the memory-mapped tensor.
+    Runs in a worker process: every worker writes its own (subject, state) slot, so no locking is needed.
+    """
+    tensor = np.load(tensor_path, mmap_mode='r+')
+    subject_index, state_index = position
+    for band_index, (_, values) in enumerate(iter_coherence_rows(csv_file, start)):
+        if band_index >= tensor.shape[2]:
+            break
+        upper, _ = row_to_upper_triangle(values, stop)
+        tensor[subject_index, state_index, band_index, :len(upper)] = upper
+    tensor.flush()
+
+
+def build_coherence_cache(subjects, states, csv_address_base, cache_directory='coherence_cache', workers=1,
+                          start=START, stop=STOP):
+    """
+    Converts the flattened coherence CSVs of every subject and state into a single memory-mapped float32
+    tensor of shape (subjects x states x bands x largest upper triangle), padded with NaN, together with a
+    JSON manifest of the subjects, states, band names and electrode counts.
+    The CSVs only have to be parsed once; afterwards every stage can open the cache with CoherenceCache.
+    Missing CSVs get an electrode count of 0. With workers > 1 the CSVs are parsed by a process pool,
+    every worker writing straight into the shared tensor file.
+    Returns the opened CoherenceCache.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    subjects, states = sorted(subjects), sorted(states)
+    files = {(s, t): csv_filename(csv_address_base, subject, state)
+             for s, subject in enumerate(subjects) for t, state in enumerate(states)}
+
+    # Only the first row of every file is read to size the tensor
+    num_nodes = np.zeros((len(subjects), len(states)), dtype=np.int64)
+    for position, csv_file in files.items():
+        num_nodes[position] = _electrode_count(csv_file, start, stop)
+    present = [position for position in files if num_nodes[position] > 0]
+    bands = _band_names(files[present[0]], start) if present else []
+    largest = int(num_nodes.max()) if num_nodes.size else 0
+
+    tensor_path = os.path.join(cache_directory, TENSOR_FILE)
+    tensor = np.lib.format.open_memmap(tensor_path, mode='w+', dtype=np.float32,
+                                       shape=(len(subjects), len(states), len(bands), largest * (largest - 1) // 2))
+    tensor[:] = np.nan
+    tensor.flush()
+    del tensor
+
+    jobs = [(tensor_path, position, files[position], start, stop) for position in present]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_fill_tensor, *zip(*jobs)))
+    else:
+        for job in jobs:
+            _fill_tensor(*job)
+
+    manifest = {
+        'subjects': subjects,
+        'states': states,
+        'bands': bands,
+        'num_nodes': num_nodes.tolist(),
+    }
+    # Written last, so an interrupted conversion is never mistaken for a complete cache
+    with open(os.path.join(cache_directory, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    return CoherenceCache(cache_directory)
+
+
+class CoherenceCache:
+    def __init__(self, cache_directory='coherence_cache'):
+        """
+        Opens a coherence cache written by build_coherence_cache. The tensor is memory-mapped read-only, so
+        opening it is instant and processes that open the same cache share its pages.
+        """
+        with open(os.path.join(cache_directory, MANIFEST_FILE), 'r') as file:
+            manifest = json.load(file)
+        self.subjects = manifest['subjects']
+        self.states = manifest['states']
+        self.bands = manifest['bands']
+        self.num_nodes = np.array(manifest['num_nodes'], dtype=np.int64)
+        self.tensor = np.load(os.path.join(cache_directory, TENSOR_FILE), mmap_mode='r')
+
+    def _band_index(self, band):
+        """
+        Returns the position of a band: a position, a band name from the CSVs, or a Wavelength (matched by
+        its value, since the CSV rows are in Wavelength order).
+        """
+        if isinstance(band, (int, np.integer)):
+            return int(band)
+        if hasattr(band, 'value'):
+            return band.value - 1
+        return self.bands.index(band)
+
+    def _position(self, subject, state, band):
+        """
+        Returns the (subject, state, band) indices of the tensor and the electrode count of the graph.
+        """
+        s, t = self.subjects.index(subject), self.states.index(state)
+        num_nodes = int(self.num_nodes[s, t])
+        if num_nodes == 0:
+            raise KeyError(f"No coherence data for Subject: {subject}, State: {state}")
+        return s, t, self._band_index(band), num_nodes
+
+    def __contains__(self, key):
+        subject, state = key[:2]
+        return (subject in self.subjects and state in self.states and
+                self.num_nodes[self.subjects.index(subject), self.states.index(state)] > 0)
+
+    def keys(self):
+        """
+        Returns the (subject, state) pairs that have coherence data.
+        """
+        return [(subject, state) for s, subject in enumerate(self.subjects)
+                for t, state in enumerate(self.states) if self.num_nodes[s, t] > 0]
+
+    def band_values(self, subject, state, band):
+        """
+        Returns the upper triangle (np.triu_indices order) of one band as a zero-copy float32 view of the
+        memory-mapped tensor, and the electrode count.
+        """
+        s, t, b, num_nodes = self._position(subject, state, band)
+        return self.tensor[s, t, b, :num_nodes * (num_nodes - 1) // 2], num_nodes
+
+    def band_matrix(self, subject, state, band):
+        """
+        Returns the dense symmetric coherence matrix of one band.
+        """
+        return upper_triangle_to_matrix(*self.band_values(subject, state, band))
+
+    def band_matrices(self, subject, state):
+        """
+        Yields the dense coherence matrix of every band of a subject and state, in band order.
+        """
+        for b in range(len(self.bands)):
+            yield self.band_matrix(subject, state, b)
+
+    def flattened_row(self, subject, state, band, stop=STOP):
+        """
+        Rebuilds the values of a band as they are laid out in the CSV row from column START on: every matrix
+        row of the upper triangle closed by the stop value.
+        """
+        upper, num_nodes = self.band_values(subject, state, band)
+        segment_lengths = num_nodes - np.arange(1, num_nodes) + 1
+        stop_positions = np.cumsum(segment_lengths) - 1
+        row = np.full(int(segment_lengths.sum()), stop, dtype=float)
+        keep = np.ones(len(row), dtype=bool)
+        keep[stop_positions] = False
+        row[keep] = upper
+        return row
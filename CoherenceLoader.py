@@ -0,0 +1,119 @@
+import warnings
+import numpy as np
+import networkx as nx
+
+# Layout of the flattened coherence CSVs: every row is one wavelength, the values start at
+# column START and the upper triangle of the matrix is stored row by row, each matrix row
+# being closed by its diagonal element (STOP).
+STOP = 1.0
+START = 2
+
+
+def parse_values(text):
+    """
+    Parses a comma-separated string of numbers into an array with a single numpy call.
+    Cells that are not numbers (empty or text) are skipped, like the csv based parsers did.
+    """
+    with warnings.catch_warnings():
+        # np.fromstring only warns when it stops early, turn that into an error to fall back on
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=',')
+        except (ValueError, DeprecationWarning):
+            pass
+
+    values = []
+    for cell in text.split(','):
+        try:
+            values.append(float(cell))
+        except ValueError:
+            pass
+    return np.array(values)
+
+
+def iter_coherence_rows(csv_file, start=START):
+    """
+    Streams a flattened coherence CSV one line at a time, without reading the whole file.
+    Yields the band name (first column) and the values from column `start` on of every row.
+    """
+    with open(csv_file, 'r') as file:
+        next(file, None)  # Skip the header row
+        for line in file:
+            cells = line.rstrip('\r\n').split(',', start)
+            if len(cells) <= start:
+                continue
+            yield cells[0], parse_values(cells[start])
+
+
+def iter_band_matrices(csv_file, start=START, stop=STOP):
+    """
+    Streams a flattened coherence CSV one band at a time.
+    Yields the band name and the dense coherence matrix of every row, so only one matrix is in memory
+    at once.
+    """
+    for band, values in iter_coherence_rows(csv_file, start):
+        yield band, row_to_matrix(values, stop)
+
+
+def row_to_upper_triangle(values, stop=STOP):
+    """
+    Converts the flattened values of one row into the upper triangle of the coherence matrix.
+    Returns the upper triangle values (in np.triu_indices order) and the number of electrodes.
+    """
+    values = np.asarray(values, dtype=float)
+    sentinels = np.flatnonzero(values == stop)
+    if sentinels.size == 0:
+        raise ValueError("Coherence row does not contain the stop value")
+
+    # The first matrix row holds n - 1 values, so the first stop value gives the electrode count
+    num_nodes = int(sentinels[0]) + 1
+
+    # Matrix row i holds n - i values followed by the stop value
+    segment_lengths = num_nodes - np.arange(1, num_nodes) + 1
+    stop_positions = np.cumsum(segment_lengths) - 1
+    total = int(segment_lengths.sum())
+    if values.size < total or not np.all(values[stop_positions] == stop):
+        raise ValueError(f"Coherence row does not describe a matrix of {num_nodes} electrodes")
+
+    keep = np.ones(total, dtype=bool)
+    keep[stop_positions] = False
+    return values[:total][keep], num_nodes
+
+
+def upper_triangle_to_matrix(upper, num_nodes):
+    """
+    Rebuilds the dense symmetric coherence matrix (zero diagonal) from its upper triangle.
+    """
+    matrix = np.zeros((num_nodes, num_nodes))
+    rows, cols = np.triu_indices(num_nodes, k=1)
+    matrix[rows, cols] = upper
+    matrix[cols, rows] = upper
+    return matrix
+
+
+def row_to_matrix(values, stop=STOP):
+    """
+    Converts the flattened values of one row into a dense coherence matrix.
+    """
+    upper, num_nodes = row_to_upper_triangle(values, stop)
+    return upper_triangle_to_matrix(upper, num_nodes)
+
+
+def load_coherence_matrices(csv_file, start=START, stop=STOP):
+    """
+    Loads a flattened coherence CSV and returns a list of dense matrices, one per wavelength.
+    """
+    return [matrix for _, matrix in iter_band_matrices(csv_file, start, stop)]
+
+
+def matrix_to_graph(matrix):
+    """
+    Builds the full weighted graph of a coherence matrix. Nodes are numbered from 1 like the electrodes.
+    """
+    num_nodes = matrix.shape[0]
+    rows, cols = np.triu_indices(num_nodes, k=1)
+
+    G = nx.Graph()
+    G.add_nodes_from(range(1, num_nodes + 1))
+    G.add_weighted_edges_from(zip((rows + 1).tolist(), (cols + 1).tolist(), matrix[rows, cols].tolist()))
+    return G
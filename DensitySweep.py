@@ -0,0 +1,107 @@
+import numpy as np
+
+# Default sweep: 20 densities from 2.5% to 50% of the possible edges
+DENSITIES = tuple(np.round(np.arange(1, 21) * 0.025, 3))
+
+# Curves with one value per density, which get an area under the curve
+SCALAR_CURVES = ('num_nodes', 'num_edges', 'mean_degree', 'mean_strength', 'average_clustering', 'transitivity',
+                 'largest_component')
+
+
+def area_under_curve(densities, values):
+    """
+    Area under a metric curve over the densities, with the trapezoidal rule.
+    """
+    densities = np.asarray(densities, dtype=float)
+    values = np.asarray(values, dtype=float)
+    return float(((densities[1:] - densities[:-1]) * (values[1:] + values[:-1]) / 2).sum())
+
+
+def _find(parents, node):
+    """Root of a node in the union-find forest, halving the path on the way."""
+    while parents[node] != node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+
+def density_sweep(matrix, densities=DENSITIES):
+    """
+    Thresholds a coherence matrix at every density of a sweep in a single pass.
+    The upper triangle is sorted once by descending weight and the edges are added one by one; degrees,
+    strengths, per-node triangle counts and connected components (union-find) are updated as every edge
+    is added, so each density only costs the edges it adds on top of the previous one.
+    Every density keeps int(num_edges * density) edges, like EdgeThreshold.threshold_edges.
+    Like the thresholded graphs, only nodes with at least one edge count as nodes of the graph.
+    Returns a dictionary with the sorted densities, one curve (array over densities) per metric in
+    SCALAR_CURVES, and the (densities x electrodes) node_degree and node_clustering curves.
+    """
+    densities = np.sort(np.asarray(densities, dtype=float))
+    num_nodes = matrix.shape[0]
+    rows, cols = np.triu_indices(num_nodes, k=1)
+    weights = matrix[rows, cols]
+    order = np.argsort(-weights, kind='stable')
+    counts = (weights.size * densities).astype(np.int64)
+
+    linked = np.zeros((num_nodes, num_nodes), dtype=bool)
+    degrees = np.zeros(num_nodes, dtype=np.int64)
+    strengths = np.zeros(num_nodes)
+    triangles = np.zeros(num_nodes, dtype=np.int64)
+    parents = list(range(num_nodes))
+    sizes = [1] * num_nodes
+    largest = 1
+
+    curves = {name: np.zeros(len(densities)) for name in SCALAR_CURVES}
+    curves['node_degree'] = np.zeros((len(densities), num_nodes))
+    curves['node_clustering'] = np.zeros((len(densities), num_nodes))
+
+    added = 0
+    for level, count in enumerate(counts):
+        for position in order[added:count]:
+            u, v = rows[position], cols[position]
+
+            # Every common neighbour closes a new triangle with the new edge
+            common = np.flatnonzero(linked[u] & linked[v])
+            triangles[common] += 1
+            triangles[u] += common.size
+            triangles[v] += common.size
+
+            linked[u, v] = linked[v, u] = True
+            degrees[u] += 1
+            degrees[v] += 1
+            strengths[u] += weights[position]
+            strengths[v] += weights[position]
+
+            root_u, root_v = _find(parents, u), _find(parents, v)
+            if root_u != root_v:
+                if sizes[root_u] < sizes[root_v]:
+                    root_u, root_v = root_v, root_u
+                parents[root_v] = root_u
+                sizes[root_u] += sizes[root_v]
+                largest = max(largest, sizes[root_u])
+        added = max(added, count)
+
+        present = degrees > 0
+        triads = degrees * (degrees - 1)
+        clustering = np.zeros(num_nodes)
+        np.divide(2 * triangles, triads, out=clustering, where=triads > 0)
+
+        curves['num_nodes'][level] = present.sum()
+        curves['num_edges'][level] = added
+        curves['mean_degree'][level] = degrees[present].mean() if present.any() else 0.0
+        curves['mean_strength'][level] = strengths[present].mean() if present.any() else 0.0
+        curves['average_clustering'][level] = clustering[present].mean() if present.any() else 0.0
+        curves['transitivity'][level] = 2 * triangles.sum() / triads.sum() if triangles.sum() > 0 else 0.0
+        curves['largest_component'][level] = largest if added > 0 else 0
+        curves['node_degree'][level] = degrees
+        curves['node_clustering'][level] = clustering
+
+    curves['densities'] = densities
+    return curves
+
+
+def sweep_auc(sweep):
+    """
+    Area under the curve of every scalar metric of a density sweep.
+    """
+    return {name: area_under_curve(sweep['densities'], sweep[name]) for name in SCALAR_CURVES}
@@ -0,0 +1,94 @@
+import numpy as np
+import networkx as nx
+
+TOP = 0.1  # Default fraction of edges to keep
+
+
+def _as_densities(densities):
+    """Accepts a single density or a sequence of densities and returns them as a tuple."""
+    if np.isscalar(densities):
+        return (densities,)
+    return tuple(densities)
+
+
+def top_edge_positions(weights, densities):
+    """
+    Finds the positions of the strongest edges for several densities with a single partial ordering.
+    Returns a dictionary mapping each density to the positions (in `weights`) of its top edges.
+    Every density keeps int(num_edges * density) edges, like the original sort based threshold.
+    """
+    weights = np.asarray(weights)
+    densities = _as_densities(densities)
+    counts = {density: int(weights.size * density) for density in densities}
+
+    # One argpartition call with every cut point puts the top k edges of each density in front
+    kth = sorted({count - 1 for count in counts.values() if 0 < count < weights.size})
+    if kth:
+        order = np.argpartition(-weights, kth)
+    else:
+        order = np.arange(weights.size)
+
+    return {density: order[:count] for density, count in counts.items()}
+
+
+def threshold_edges_multi(matrix, densities):
+    """
+    Thresholds a coherence matrix at several densities in one call.
+    Returns a dictionary mapping each density to (rows, cols, weights) arrays of the kept edges,
+    with 0-based electrode indices taken from the upper triangle.
+    """
+    rows, cols = np.triu_indices(matrix.shape[0], k=1)
+    upper = matrix[rows, cols]
+    positions = top_edge_positions(upper, densities)
+    return {density: (rows[kept], cols[kept], upper[kept]) for density, kept in positions.items()}
+
+
+def threshold_edges(matrix, top=TOP):
+    """
+    Thresholds a coherence matrix by keeping only the top percentage of edges.
+    Returns (rows, cols, weights) arrays of the kept edges.
+    """
+    return threshold_edges_multi(matrix, top)[top]
+
+
+def threshold_matrix(matrix, top=TOP):
+    """
+    Returns a dense copy of the coherence matrix where only the top percentage of edges is kept.
+    """
+    rows, cols, weights = threshold_edges(matrix, top)
+    thresholded = np.zeros_like(matrix)
+    thresholded[rows, cols] = weights
+    thresholded[cols, rows] = weights
+    return thresholded
+
+
+def edges_to_graph(rows, cols, weights):
+    """
+    Builds a weighted graph from thresholded edge arrays. Nodes are numbered from 1 like the electrodes,
+    and only the electrodes that keep at least one edge are added.
+    """
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip((rows + 1).tolist(), (cols + 1).tolist(), np.asarray(weights).tolist()))
+    return G
+
+
+def threshold_graph_multi(G, densities):
+    """
+    Thresholds an existing graph at several densities, keeping the top percentage of edges by weight.
+    Returns a dictionary mapping each density to its thresholded graph.
+    """
+    edges = list(G.edges(data='weight'))
+    weights = np.fromiter((edge[2] for edge in edges), dtype=float, count=len(edges))
+    positions = top_edge_positions(weights, densities)
+
+    graphs = {}
+    for density, kept in positions.items():
+        G_top = nx.Graph()
+        G_top.add_weighted_edges_from(edges[i] for i in kept.tolist())
+        graphs[density] = G_top
+    return graphs
+
+
+def threshold_graph(G, top=TOP):
+    """Threshold the graph by keeping only the top percentage of edges."""
+    return threshold_graph_multi(G, top)[top]
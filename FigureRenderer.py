@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+
+INDEX_FILE = 'render_index.json'
+
+# Figures kept alive in a rendering process, by figure kind, so every figure of a kind reuses them
+_figures = {}
+
+# Binary graph stores opened by a rendering process, by filename, modification time and size, so a store
+# rewritten since it was opened is opened again
+_graph_stores = {}
+
+
+def prepare_axes(fig=None, figsize=(10, 6)):
+    """
+    Returns a figure and its single axes to draw on. A figure passed in is reused: its axes are cleared
+    instead of allocating a new figure. Without one, a new pyplot figure is created.
+    """
+    import matplotlib.pyplot as plt
+    if fig is None:
+        fig = plt.figure(figsize=figsize)
+    elif len(fig.axes) == 1:
+        fig.axes[0].clear()
+        return fig, fig.axes[0]
+    else:
+        fig.clf()
+    fig.set_size_inches(figsize)
+    return fig, fig.add_subplot()
+
+
+def prepare_figure(fig=None, figsize=(10, 6)):
+    """
+    Returns an empty figure for a multi-panel plot, reusing (and clearing) the figure passed in.
+    """
+    import matplotlib.pyplot as plt
+    if fig is None:
+        return plt.figure(figsize=figsize)
+    fig.clf()
+    fig.set_size_inches(figsize)
+    return fig
+
+
+def finish_figure(fig, save_path=None, reused=False):
+    """
+    Shows a figure, or saves it to `save_path` in headless mode. Saved pyplot figures are closed unless they
+    are reused for the next plot.
+    """
+    if save_path is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+        return
+    fig.savefig(save_path)
+    # Only figures created through pyplot are registered with it and need closing
+    if not reused and fig.canvas.manager is not None:
+        import matplotlib.pyplot as plt
+        plt.close(fig)
+
+
+def input_digest(*inputs):
+    """
+    Hash of the inputs of a figure (DataFrames, arrays, strings...), used to skip figures whose inputs have
+    not changed since they were rendered.
+    """
+    digest = hashlib.sha256()
+    for value in inputs:
+        if hasattr(value, 'to_csv'):
+            value = value.to_csv(index=False)
+        digest.update(pickle.dumps(value) if not isinstance(value, str) else value.encode())
+    return digest.hexdigest()
+
+
+def _init_renderer():
+    """Switches a rendering process to the headless Agg backend."""
+    matplotlib.use('Agg')
+
+
+def _reused_figure(kind):
+    """
+    Returns the figure of a kind kept in this process, creating it the first time. The figure is drawn on
+    its own Agg canvas, outside pyplot, so rendering does not depend on (or change) the pyplot backend.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    if kind not in _figures:
+        _figures[kind] = Figure()
+        FigureCanvasAgg(_figures[kind])
+    return _figures[kind]
+
+
+def _load_graph(graph_file, key):
+    """
+    Loads the graph of a (subject, state, wavelength) key from its GraphML file, or from the binary graph
+    store (.npz) the metadata points it to.
+    """
+    import networkx as nx
+    if graph_file.endswith('.npz'):
+        from GraphStore import GraphStore
+        stat = os.stat(graph_file)
+        store_key = (graph_file, stat.st_mtime_ns, stat.st_size)
+        if store_key not in _graph_stores:
+            _graph_stores.clear()
+            _graph_stores[store_key] = GraphStore(graph_file)
+        return _graph_stores[store_key].get_graph(key)
+    return nx.read_graphml(graph_file)
+
+
+def _render(task):
+    """
+    Draws one figure task in a rendering process and saves it. Returns the saved path.
+    """
+    kind, arguments, save_path = task
+    fig = _reused_figure(kind)
+
+    if kind == 'mean_global_metric':
+        from GraphPlotter import GraphPlotter
+        mean_df, metric_name = arguments
+        GraphPlotter.plot_mean_global_metric(mean_df, metric_name, save_path, fig)
+    elif kind == 'node_metric_distribution':
+        from GraphPlotter import GraphPlotter
+        distributions, metric_name, wavelength = arguments
+        GraphPlotter.plot_node_metric_distribution(distributions, metric_name, wavelength, save_path, fig)
+    elif kind == 'node_gcc_distribution':
+        from GraphPlotter import GraphPlotter
+        GraphPlotter.plot_node_gcc_distribution(arguments, save_path, fig)
+    elif kind == 'graph':
+        from CC import visualize
+        graph_file, key = arguments
+        visualize(_load_graph(graph_file, key), save_path, fig)
+    else:
+        raise ValueError(f"Unknown figure kind: {kind}")
+    return save_path
+
+
+def figure_tasks(metrics_source, figure_directory, graph_metadata=None, kde_cache_directory=None):
+    """
+    Lists the figures of a report: the mean of every global metric by wavelength and state, the node GCC
+    distributions, the distribution of every node-level metric per wavelength, and, with a graph metadata
+    map, a drawing of every (subject, state, wavelength) graph.
+    The node-metric distributions are precomputed here (cached in `kde_cache_directory`, by default
+    kde_cache inside the figure directory), so the rendering processes only draw curves.
+    Returns a list of (kind, arguments, save path, input digest) tasks.
+    """
+    from GraphPlotter import GraphPlotter
+    plotter = GraphPlotter(metrics_source)
+    tasks = []
+
+    for metric_name in plotter.table.metric_names('global'):
+        mean_df = plotter.calculate_mean_global_metric(metric_name)
+        tasks.append(('mean_global_metric', (mean_df, metric_name),
+                      os.path.join(figure_directory, f"mean_{metric_name}.png"), input_digest(mean_df, metric_name)))
+
+    if kde_cache_directory is None:
+        kde_cache_directory = os.path.join(figure_directory, 'kde_cache')
+    for metric_name in plotter.table.metric_names('node'):
+        distributions = plotter.node_metric_distributions(metric_name, kde_cache_directory)
+        if metric_name == 'clustering_coefficient':
+            tasks.append(('node_gcc_distribution', distributions,
+                          os.path.join(figure_directory, 'node_gcc_distribution.png'),
+                          input_digest(*[(key, entry['digest']) for key, entry in distributions.items()])))
+
+        for wavelength in dict.fromkeys(band for band, _ in distributions):
+            band = {state: entry for (name, state), entry in distributions.items() if name == wavelength}
+            tasks.append(('node_metric_distribution', (band, metric_name, wavelength),
+                          os.path.join(figure_directory, f"{metric_name}_{wavelength}.png"),
+                          input_digest(metric_name, *[(state, entry['digest']) for state, entry in band.items()])))
+
+    # A graph is redrawn when its content changes, not when its file (or a shared graph store) is rewritten
+    from MetricCache import graph_hash
+    for key, graph_file in (graph_metadata or {}).items():
+        subject, state, wavelength = key
+        tasks.append(('graph', (graph_file, key),
+                      os.path.join(figure_directory, f"graph_{subject}_{state}_{wavelength.name}.png"),
+                      input_digest(graph_hash(_load_graph(graph_file, key)))))
+    return tasks
+
+
+def render_figures(metrics_source, figure_directory='figures', graph_metadata=None, workers=1, force=False):
+    """
+    Headless batch rendering: draws every figure of figure_tasks on an Agg canvas and writes it to
+    `figure_directory` instead of showing it. Figures are spread over a process pool; every process reuses
+    one figure per kind. The pyplot backend of the calling process is left as it is.
+    A figure whose input digest is unchanged since it was last rendered (recorded in render_index.json) and
+    whose file still exists is skipped, unless `force` is set.
+    Returns the rendered and the skipped paths.
+    """
+    os.makedirs(figure_directory, exist_ok=True)
+    index_file = os.path.join(figure_directory, INDEX_FILE)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file, 'r') as file:
+            index = json.load(file)
+
+    tasks = figure_tasks(metrics_source, figure_directory, graph_metadata)
+    to_render, skipped = [], []
+    for task in tasks:
+        if force or index.get(os.path.basename(task[2])) != task[3] or not os.path.exists(task[2]):
+            to_render.append(task)
+        else:
+            skipped.append(task[2])
+
+    # Tasks of the same kind go to the same chunks, so the reused figures keep their layout
+    to_render.sort(key=lambda task: task[0])
+    jobs = [task[:3] for task in to_render]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_renderer) as executor:
+            rendered = list(executor.map(_render, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+    else:
+        rendered = [_render(job) for job in jobs]
+
+    for task in to_render:
+        index[os.path.basename(task[2])] = task[3]
+    with open(index_file, 'w') as file:
+        json.dump(index, file, indent=2)
+
+    return {'rendered': rendered, 'skipped': skipped}
@@ -1,8 +1,14 @@
 import csv
 import networkx as nx
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import Enum
 import pickle
+from CoherenceCache import CoherenceCache
+from CoherenceLoader import iter_band_matrices
+from DensitySweep import DENSITIES, density_sweep, sweep_auc
+from EdgeThreshold import edges_to_graph, threshold_edges, threshold_edges_multi, threshold_graph
+from GraphStore import GraphStore, save_graph_store
 
 
 class Wavelength(Enum):
@@ -24,10 +30,10 @@ subjects = {"03", "06", "07", "10", "13", "14", "16", "17", "18", "19", "20", "2
             "31", "37", "38", "40", "41", "43", "45", "46", "48", "49", "50", "54", "55", "60", "63"}
 states = {"rest", "film"}
 graphml_directory = "saved_graphml_files"
-metadata_map = {}  # Dictionary to hold graph file paths with key (subject, state, wavelength)
-
-# Ensure the GraphML directory exists
-os.makedirs(graphml_directory, exist_ok=True)
+graph_format = "graphml"  # "graphml" for one file per graph, "npz" for a single binary graph store
+metadata_file = "graph_metadata.pkl"  # Pickle of the graph file paths with key (subject, state, wavelength)
+workers = os.cpu_count()  # Number of processes used to build the graphs
+coherence_cache = None  # Directory of a CoherenceCache to read the matrices from instead of parsing the CSVs
 
 # Base CSV file address
 csv_address_base = "C:/Users/guygu/Desktop/לימודים/מוח/פרקטיקום/FC_matrix_by_frequncy_bands" \
@@ -71,24 +77,32 @@ def build_graph_from_row(row, start=START, stop=STOP):
 
 def threshold(G, top=TOP):
     """Threshold the graph by keeping only the top percentage of edges."""
-    sorted_edges = sorted(G.edges(data=True), key=lambda x: x[2]['weight'], reverse=True)
-    num_edges_to_keep = int(len(sorted_edges) * top)
-    top_edges = sorted_edges[:num_edges_to_keep]
+    return threshold_graph(G, top)
 
-    G_top = nx.Graph()
-    for edge in top_edges:
-        G_top.add_node(edge[0])
-        G_top.add_node(edge[1])
-    G_top.add_edges_from(top_edges)
 
-    return G_top
+def build_graphs_at_densities(csv_file, densities, start=START, stop=STOP):
+    """
+    Builds the thresholded graphs of every wavelength in the CSV file for several densities at once.
+    Returns a dictionary mapping each density to its list of graphs (one per wavelength).
+    The file is streamed one wavelength at a time, so only a single coherence matrix is held in memory.
+    """
+    graphs = {density: [] for density in densities}
+    for _, matrix in iter_band_matrices(csv_file, start, stop):
+        for density, edges in threshold_edges_multi(matrix, densities).items():
+            graphs[density].append(edges_to_graph(*edges))
+    return graphs
 
 
-def build_graphs_from_csv(csv_file, start=START, stop=STOP):
+def build_graphs_from_csv(csv_file, start=START, stop=STOP, backend="numpy", top=TOP):
     """
     Builds a list of graphs, one per row in the CSV file.
     Each row corresponds to a different wavelength.
+    The "numpy" backend streams the file one row at a time with vectorized parsing, the "csv" backend walks
+    the rows cell by cell.
     """
+    if backend == "numpy":
+        return build_graphs_at_densities(csv_file, [top], start, stop)[top]
+
     graphs = []
 
     # Read CSV file and build graphs for each row
@@ -99,7 +113,7 @@ def build_graphs_from_csv(csv_file, start=START, stop=STOP):
         # Process each row and treat it as a graph corresponding to a wavelength
         for row in reader:
             graph = build_graph_from_row(row, start, stop)
-            graph_top = threshold(graph)
+            graph_top = threshold(graph, top)
             graphs.append(graph_top)
 
     return graphs
@@ -122,30 +136,176 @@ def load_metadata(filename='graph_metadata.pkl'):
         return pickle.load(file)
 
 
-def save_graphs(subjects, states, csv_address_base, graphml_directory):
+def subject_state_matrices(subject, state, csv_address_base, coherence_cache=None):
     """
-    Loops through each subject and state, builds graphs from CSV,
-    and saves them to GraphML files. Metadata is stored in a dictionary.
+    Yields the coherence matrix of every wavelength of a subject and state, sliced from the coherence cache
+    directory when one is given, otherwise streamed from its CSV.
+    """
+    if coherence_cache is not None:
+        return CoherenceCache(coherence_cache).band_matrices(subject, state)
+    csv_file = f"{csv_address_base}{subject}_{state}_coherence.csv"
+    return (matrix for _, matrix in iter_band_matrices(csv_file))
+
+
+def save_subject_state_graphs(subject, state, csv_address_base, graphml_directory, coherence_cache=None):
+    """
+    Builds the graphs of a single subject and state from its CSV and saves them to GraphML files.
+    With a coherence cache directory the matrices are sliced from the cache instead of parsing the CSV.
+    Returns a list of (wavelength name, GraphML filename) pairs.
+    """
+    matrices = subject_state_matrices(subject, state, csv_address_base, coherence_cache)
+
+    saved = []
+    for wavelength_enum, matrix in zip(Wavelength, matrices):
+        graph = edges_to_graph(*threshold_edges(matrix, TOP))
+        # Create a unique filename for each graph
+        graphml_filename = f"{graphml_directory}/graph_{subject}_{state}_{wavelength_enum.name}.graphml"
+        save_graph_to_graphml(graph, graphml_filename)
+        saved.append((wavelength_enum.name, graphml_filename))
+    return saved
+
+
+def build_subject_state_edges(subject, state, csv_address_base, coherence_cache=None, top=TOP):
+    """
+    Builds the thresholded edge lists of a single subject and state from its CSV, or from the coherence
+    cache directory when one is given.
+    Returns a list of (wavelength name, (rows, cols, weights, num_nodes)) pairs.
+    """
+    matrices = subject_state_matrices(subject, state, csv_address_base, coherence_cache)
+    return [(wavelength_enum.name, threshold_edges(matrix, top) + (matrix.shape[0],))
+            for wavelength_enum, matrix in zip(Wavelength, matrices)]
+
+
+def sweep_subject_state(subject, state, csv_address_base, densities=DENSITIES, coherence_cache=None):
     """
-    for subject in subjects:
-        for state in states:
-            # Construct CSV filename for each subject and state
-            csv_file = f"{csv_address_base}{subject}_{state}_coherence.csv"
-            graphs = build_graphs_from_csv(csv_file)
+    Runs a density sweep (see DensitySweep.density_sweep) on every wavelength of a single subject and state,
+    and adds the area under the curve of every scalar metric to the sweep under 'auc'.
+    Returns a list of (wavelength name, sweep) pairs.
+    """
+    matrices = subject_state_matrices(subject, state, csv_address_base, coherence_cache)
+    sweeps = []
+    for wavelength_enum, matrix in zip(Wavelength, matrices):
+        sweep = density_sweep(matrix, densities)
+        sweep['auc'] = sweep_auc(sweep)
+        sweeps.append((wavelength_enum.name, sweep))
+    return sweeps
 
-            # Store each graph by its wavelength in the metadata map
-            for wavelength_enum, graph in zip(Wavelength, graphs):
-                # Create a unique filename for each graph
-                graphml_filename = f"{graphml_directory}/graph_{subject}_{state}_{wavelength_enum.name}.graphml"
-                save_graph_to_graphml(graph, graphml_filename)
 
-                # Store the file path in the metadata map
-                key = (subject, state, wavelength_enum)
-                metadata_map[key] = graphml_filename
+def run_subject_state_jobs(job, jobs, job_args, workers=1, action="build graphs"):
+    """
+    Runs job(subject, state, *job_args) for every (subject, state) pair of `jobs`, in a process pool when
+    workers > 1. A pair that fails is reported and skipped without aborting the run.
+    Returns the results keyed by (subject, state) and the failed pairs.
+    """
+    saved = {}
+    failures = []
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(job, subject, state, *job_args): (subject, state)
+                       for subject, state in jobs}
+            for future in as_completed(futures):
+                subject, state = futures[future]
+                try:
+                    saved[(subject, state)] = future.result()
+                except Exception as e:
+                    print(f"Failed to {action} for Subject: {subject}, State: {state}: {e}")
+                    failures.append((subject, state))
+    else:
+        for subject, state in jobs:
+            try:
+                saved[(subject, state)] = job(subject, state, *job_args)
+            except Exception as e:
+                print(f"Failed to {action} for Subject: {subject}, State: {state}: {e}")
+                failures.append((subject, state))
+
+    return saved, failures
+
+
+def save_graphs(subjects, states, csv_address_base, graphml_directory, workers=1, graph_format="graphml",
+                coherence_cache=None, metadata_file="graph_metadata.pkl"):
+    """
+    Loops through each subject and state, builds graphs from CSV,
+    and saves them to GraphML files. Metadata is stored in a dictionary saved to `metadata_file`.
+    With graph_format="npz" the thresholded edge lists of every graph are saved to a single binary
+    graph store instead, and the metadata map points every key to that store. The graphs an earlier run
+    stored for pairs that are not rebuilt (failed or not requested) are kept in the store.
+    With workers > 1 the (subject, state) pairs are built in a process pool. A pair that fails is
+    reported and skipped without aborting the run. Returns the metadata map and the failed pairs.
+    With a coherence cache directory (see CoherenceCache.build_coherence_cache) the matrices are read from
+    the memory-mapped cache, shared by all the workers, instead of parsing the CSVs again.
+    """
+    # Ensure the GraphML directory exists
+    os.makedirs(graphml_directory, exist_ok=True)
+
+    if graph_format == "npz":
+        build_job = build_subject_state_edges
+        job_args = (csv_address_base, coherence_cache)
+    else:
+        build_job = save_subject_state_graphs
+        job_args = (csv_address_base, graphml_directory, coherence_cache)
+
+    # Sorted jobs keep the metadata map in the same order whatever the completion order is
+    jobs = [(subject, state) for subject in sorted(subjects) for state in sorted(states)]
+    saved, failures = run_subject_state_jobs(build_job, jobs, job_args, workers)
+
+    # Merge the results of every (subject, state) into the metadata map
+    metadata_map = {}
+    edge_lists = {}
+    store_filename = f"{graphml_directory}/graph_store.npz"
+    if graph_format == "npz" and os.path.exists(store_filename):
+        # Keep the graphs of the pairs that were not rebuilt in this run
+        store = GraphStore(store_filename)
+        for subject, state, wavelength_name in store.keys():
+            if (subject, state) not in saved:
+                key = (subject, state, Wavelength[wavelength_name])
+                edge_lists[key] = store.get_arrays(key)
+                metadata_map[key] = store_filename
+
+    for subject, state in jobs:
+        for wavelength_name, result in saved.get((subject, state), []):
+            key = (subject, state, Wavelength[wavelength_name])
+            if graph_format == "npz":
+                edge_lists[key] = result
+                metadata_map[key] = store_filename
+            else:
+                metadata_map[key] = result
+
+    if graph_format == "npz":
+        save_graph_store(edge_lists, store_filename)
 
     # Save the metadata map
-    save_metadata(metadata_map)
+    save_metadata(metadata_map, metadata_file)
+
+    return metadata_map, sorted(failures)
+
+
+def sweep_graphs(subjects, states, csv_address_base, densities=DENSITIES, workers=1, coherence_cache=None,
+                 output_file='density_sweep.pkl'):
+    """
+    Sweep mode: instead of a single threshold, every graph is built over a whole range of densities by adding
+    its edges in descending weight order, and its metrics are reported as curves over the densities, with
+    their areas under the curve under 'auc'.
+    The sweeps are saved to `output_file` as a dictionary keyed by (subject, state, wavelength).
+    Returns the sweeps and the (subject, state) pairs that failed.
+    """
+    jobs = [(subject, state) for subject in sorted(subjects) for state in sorted(states)]
+    saved, failures = run_subject_state_jobs(sweep_subject_state, jobs,
+                                             (csv_address_base, densities, coherence_cache), workers,
+                                             "sweep graphs")
+
+    sweeps = {}
+    for subject, state in jobs:
+        for wavelength_name, sweep in saved.get((subject, state), []):
+            sweeps[(subject, state, Wavelength[wavelength_name])] = sweep
+
+    with open(output_file, 'wb') as file:
+        pickle.dump(sweeps, file)
+
+    return sweeps, sorted(failures)
 
 
-# Example usage: Save the graphs for each subject, state, and wavelength to GraphML files
-save_graphs(subjects, states, csv_address_base, graphml_directory)
\ No newline at end of file
+if __name__ == "__main__":
+    # Example usage: Save the graphs for each subject, state, and wavelength to GraphML files
+    save_graphs(subjects, states, csv_address_base, graphml_directory, workers, graph_format, coherence_cache,
+                metadata_file)
@@ -1,13 +1,101 @@
+import functools
+import hashlib
+import json
 import networkx as nx
+import os
 import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import MatrixMetrics
+import Modularity
+import NullModels
+import PathMetrics
+from GraphStore import GraphStore
+from Instrumentation import measure
+from MetricCache import MetricCache, graph_hash, metric_params, metric_version
+from MetricsTable import MetricsTable
+from SparseGraph import SparseGraph
 from shared import Wavelength
 
+# GraphMetrics instance used by the worker processes of the parallel executor
+_worker_graph_metrics = None
+
+
+def _init_worker(graph_metrics):
+    """
+    Stores the GraphMetrics instance in a worker process, so it is only sent once per process.
+    """
+    global _worker_graph_metrics
+    _worker_graph_metrics = graph_metrics
+    # The graphs are already spread over the worker processes, so their Louvain restarts run serially
+    graph_metrics.louvain_workers = 1
+    if graph_metrics.profiler is not None:
+        graph_metrics.profiler = graph_metrics.profiler.worker_copy()
+
+
+def _calculate_chunk(chunk):
+    """
+    Calculates the metrics of a chunk of (key, graph file) pairs in a worker process.
+    Returns the metrics of every graph together with its Louvain partition entry, and the profiler records
+    of the chunk (empty without a profiler).
+    """
+    results = []
+    for key, graph_file in chunk:
+        graph = _worker_graph_metrics.load_graph(graph_file, key)
+        metrics = _worker_graph_metrics.calculate_metrics(graph, key)
+        results.append((metrics, _worker_graph_metrics.partitions.get(GraphMetrics.partition_key(key))))
+    profiler = _worker_graph_metrics.profiler
+    return results, profiler.drain() if profiler is not None else []
+
+
 class GraphMetrics:
-    def __init__(self, metadata_file):
+    def __init__(self, metadata_file, cache=None, backend='matrix', backends=None, louvain_restarts=10,
+                 louvain_seed=0, louvain_workers=None, partitions_file='graph_partitions.pkl', warm_start_file=None,
+                 num_null_models=0, null_swaps_per_edge=10, null_seed=0, null_workers=1, profiler=None,
+                 sparse_graphs=False):
         """
         Initializes the GraphMetrics class by loading the metadata and defining metric functions.
+        An optional MetricCache lets repeated runs only calculate the metrics that are missing or outdated.
+        `backend` selects how the metrics that have both implementations are calculated: 'networkx' walks the
+        adjacency dictionaries, 'matrix' uses sparse matrix products. `backends` overrides it per metric name.
+        Louvain partitions are the best of `louvain_restarts` seeded runs, spread over `louvain_workers`
+        processes (by default one per restart, up to the number of CPUs). They are persisted in
+        `partitions_file` and reused while the graph, the restarts and the seed are unchanged. New partitions
+        are warm-started from the same graph in `warm_start_file` (for example the partitions of a nearby
+        density) or from the other state in an earlier run.
+        With num_null_models > 0, normalized clustering, normalized path length and the sigma/omega
+        small-world indices are added to the global metrics, against that many degree-preserving randomized
+        graphs and lattices per graph (see NullModels).
+        An optional Profiler (see Instrumentation) records the time and memory of loading every graph and of
+        every metric of every graph, including the metrics that fail.
+        With sparse_graphs, graphs are loaded as CSR-backed SparseGraphs instead of nx.Graphs. The matrix
+        metrics use them directly, and the metrics that need NetworkX (Louvain, the 'networkx' backend)
+        convert them once per graph.
         """
         self.metadata = self.load_metadata(metadata_file)
+        self.cache = cache
+        self.backend = backend
+        self.backends = backends or {}
+        self.graph_stores = {}  # Binary graph stores opened so far, by filename
+        self.adjacency_cache = None  # (graph, nodes, adjacency) of the last graph converted to a matrix
+        self.path_cache = None  # (graph, lengths, distances) of the last graph with shortest paths
+        self.louvain_restarts = louvain_restarts
+        self.louvain_seed = louvain_seed
+        self.louvain_workers = (min(louvain_restarts, os.cpu_count() or 1) if louvain_workers is None
+                                else louvain_workers)
+        self.partitions_file = partitions_file
+        self.partitions = Modularity.load_partitions(partitions_file)
+        self.previous_partitions = dict(self.partitions)  # Partitions of earlier runs, used for warm starts
+        self.warm_start_partitions = Modularity.load_partitions(warm_start_file)
+        self.partition_cache = None  # (graph, restarts, seed, partition) of the last graph partitioned
+        self.current_key = None  # Key of the graph whose metrics are being calculated
+        self.num_null_models = num_null_models
+        self.null_swaps_per_edge = null_swaps_per_edge
+        self.null_seed = null_seed
+        self.null_workers = null_workers
+        self.small_world_cache = None  # (graph, indices) of the last graph compared with its null models
+        self.profiler = profiler
+        self.sparse_graphs = sparse_graphs
+        self.networkx_cache = None  # (graph, nx.Graph) of the last SparseGraph converted to NetworkX
         self.global_metrics_registry = self.register_global_metrics()
         self.node_metrics_registry = self.register_node_metrics()
 
@@ -22,22 +110,110 @@ class GraphMetrics:
         """
         Registers global graph-level metric functions.
         """
+        # Louvain metrics carry the restarts and seed, so cached values are kept apart per setting
+        louvain = {'restarts': self.louvain_restarts, 'seed': self.louvain_seed}
         global_metrics = {
-            'modularity': self.modularity,
-            'global_clustering_coefficient': self.global_clustering_coefficient,
+            'modularity': functools.partial(self.modularity, **louvain),
+            'global_clustering_coefficient': self.select_backend('global_clustering_coefficient',
+                                                                 self.global_clustering_coefficient,
+                                                                 self.matrix_global_clustering_coefficient),
+            'characteristic_path_length': self.characteristic_path_length,
+            'global_efficiency': self.global_efficiency,
         }
+
+        # Small-world metrics share one null model ensemble per graph
+        if self.num_null_models > 0:
+            for index in ('normalized_clustering', 'normalized_path_length', 'sigma', 'omega'):
+                metric_name = index if index.startswith('normalized') else f"small_world_{index}"
+                global_metrics[metric_name] = functools.partial(
+                    self.small_world_metric, index=index, num_nulls=self.num_null_models,
+                    swaps_per_edge=self.null_swaps_per_edge, seed=self.null_seed)
         return global_metrics
 
     def register_node_metrics(self):
         """
         Registers node-level metric functions (for each node).
         """
+        louvain = {'restarts': self.louvain_restarts, 'seed': self.louvain_seed}
         node_metrics = {
-            'degree_centrality': self.node_degree_centrality,
-            'clustering_coefficient': self.node_clustering_coefficient,
+            'degree_centrality': self.select_backend('degree_centrality', self.node_degree_centrality,
+                                                     self.matrix_node_degree_centrality),
+            'clustering_coefficient': self.select_backend('clustering_coefficient', self.node_clustering_coefficient,
+                                                          self.matrix_node_clustering_coefficient),
+            'weighted_clustering_coefficient': self.select_backend('weighted_clustering_coefficient',
+                                                                   self.node_weighted_clustering_coefficient,
+                                                                   self.matrix_node_weighted_clustering_coefficient),
+            'strength': self.select_backend('strength', self.node_strength, self.matrix_node_strength),
+            'participation_coefficient': functools.partial(self.node_participation_coefficient, **louvain),
+            'within_module_degree': functools.partial(self.node_within_module_degree, **louvain),
+            'closeness_centrality': self.node_closeness_centrality,
+            'betweenness_centrality': self.node_betweenness_centrality,
+            'local_efficiency': self.node_local_efficiency,
         }
         return node_metrics
 
+    def metrics_signature(self):
+        """
+        Hash of what the metric values depend on besides the graph: the options that change them and, for
+        every registered metric, its name, parameters and version (see MetricCache). Changing an option or
+        the registry changes the signature, so the metrics saved under another one are recalculated.
+        """
+        options = {
+            'backend': self.backend,
+            'backends': self.backends,
+            'louvain_restarts': self.louvain_restarts,
+            'louvain_seed': self.louvain_seed,
+            'num_null_models': self.num_null_models,
+            'null_swaps_per_edge': self.null_swaps_per_edge,
+            'null_seed': self.null_seed,
+        }
+        registries = {'global': self.global_metrics_registry, 'node': self.node_metrics_registry}
+        metrics = {scope: {metric_name: {'params': metric_params(metric_func), 'version': metric_version(metric_func)}
+                           for metric_name, metric_func in registry.items()}
+                   for scope, registry in registries.items()}
+        signature = {'options': options, 'metrics': metrics}
+        return hashlib.sha256(json.dumps(signature, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def select_backend(self, metric_name, networkx_func, matrix_func):
+        """
+        Picks the NetworkX or the matrix implementation of a metric, according to its backend.
+        """
+        if self.backends.get(metric_name, self.backend) == 'matrix':
+            return matrix_func
+        return networkx_func
+
+    def adjacency(self, graph):
+        """
+        Returns the node list and the sparse adjacency matrix of a graph.
+        The conversion is kept for the last graph, so every matrix metric of a graph shares it.
+        """
+        if self.adjacency_cache is None or self.adjacency_cache[0] is not graph:
+            nodes, adjacency = MatrixMetrics.to_adjacency(graph)
+            self.adjacency_cache = (graph, nodes, adjacency)
+        return self.adjacency_cache[1], self.adjacency_cache[2]
+
+    def networkx_graph(self, graph):
+        """
+        Returns the graph as an nx.Graph, for the metrics that need NetworkX. A SparseGraph is converted once
+        and the conversion is kept for the last graph.
+        """
+        if not isinstance(graph, SparseGraph):
+            return graph
+        if self.networkx_cache is None or self.networkx_cache[0] is not graph:
+            self.networkx_cache = (graph, graph.to_networkx())
+        return self.networkx_cache[1]
+
+    def shortest_paths(self, graph):
+        """
+        Returns the edge lengths (1 / coherence) and the all-pairs shortest path distances of a graph.
+        They are kept for the last graph, so every path-based metric of a graph shares one distance matrix.
+        """
+        if self.path_cache is None or self.path_cache[0] is not graph:
+            _, adjacency = self.adjacency(graph)
+            lengths = PathMetrics.length_matrix(adjacency)
+            self.path_cache = (graph, lengths, PathMetrics.distance_matrix(lengths))
+        return self.path_cache[1], self.path_cache[2]
+
     def num_nodes(self, graph):
         """
         Calculates the number of nodes (global metric).
@@ -50,100 +226,396 @@ class GraphMetrics:
         """
         return graph.number_of_edges()
 
-    def modularity(self, graph):
+    @staticmethod
+    def partition_key(key):
+        """
+        Returns the (subject, state, wavelength name) key partitions are stored under, or None without a key.
+        """
+        if key is None:
+            return None
+        subject, state, wavelength = key
+        return subject, state, getattr(wavelength, 'name', wavelength)
+
+    def warm_start(self, key):
+        """
+        Returns a partition to warm-start Louvain for a key: the same graph in the warm start partitions,
+        otherwise the same subject and wavelength in another state from an earlier run. Only partitions that
+        existed before this run are used, so the results do not depend on the order graphs are processed in.
+        Returns None when there is none.
+        """
+        if key is None:
+            return None
+        if key in self.warm_start_partitions:
+            return self.warm_start_partitions[key]['partition']
+
+        subject, state, wavelength = key
+        for (other_subject, other_state, other_wavelength), entry in self.previous_partitions.items():
+            if other_subject == subject and other_wavelength == wavelength and other_state != state:
+                return entry['partition']
+        return None
+
+    def partition(self, graph, restarts=None, seed=None):
+        """
+        Returns the best Louvain partition of the graph over `restarts` runs seeded from `seed` (by default
+        louvain_restarts and louvain_seed). It is calculated once per graph and shared by modularity,
+        participation coefficient and within-module degree, and is kept in self.partitions under the current
+        key together with the graph hash, the restarts and the seed, so it is reused while the graph and the
+        Louvain settings are unchanged.
+        """
+        restarts = self.louvain_restarts if restarts is None else restarts
+        seed = self.louvain_seed if seed is None else seed
+        if (self.partition_cache is not None and self.partition_cache[0] is graph and
+                self.partition_cache[1:3] == (restarts, seed)):
+            return self.partition_cache[3]
+
+        key = self.partition_key(self.current_key)
+        digest = graph_hash(graph)
+        entry = self.partitions.get(key)
+        if (entry is None or entry['graph_hash'] != digest or entry.get('restarts') != restarts or
+                entry.get('seed') != seed):
+            partition, modularity = Modularity.best_partition(self.networkx_graph(graph), restarts, seed,
+                                                              self.louvain_workers, self.warm_start(key))
+            entry = {'graph_hash': digest, 'restarts': restarts, 'seed': seed, 'partition': partition,
+                     'modularity': modularity}
+            if key is not None:
+                self.partitions[key] = entry
+
+        self.partition_cache = (graph, restarts, seed, entry['partition'])
+        return entry['partition']
+
+    def modularity(self, graph, restarts=None, seed=None):
         """
         Calculates the modularity of the graph (global metric).
         """
         import community
-        partition = community.best_partition(graph)
-        return community.modularity(partition, graph)
+        return community.modularity(self.partition(graph, restarts, seed), self.networkx_graph(graph))
+
+    def small_world_metric(self, graph, index, num_nulls, swaps_per_edge, seed):
+        """
+        Calculates one small-world index of the graph against its null models (global metric).
+        The null models are generated once per graph and shared by all the indices.
+        """
+        if self.small_world_cache is None or self.small_world_cache[0] is not graph:
+            _, adjacency = self.adjacency(graph)
+            indices = NullModels.small_world_metrics(adjacency, num_nulls, swaps_per_edge, seed, self.null_workers)
+            self.small_world_cache = (graph, indices)
+        return self.small_world_cache[1][index]
 
     def global_clustering_coefficient(self, graph):
         """
         Calculates the global clustering coefficient (transitivity) (global metric).
         """
-        return nx.transitivity(graph)
+        return nx.transitivity(self.networkx_graph(graph))
+
+    def characteristic_path_length(self, graph):
+        """
+        Calculates the mean shortest path length between connected nodes (global metric).
+        """
+        _, distances = self.shortest_paths(graph)
+        return PathMetrics.characteristic_path_length(distances)
+
+    def global_efficiency(self, graph):
+        """
+        Calculates the mean inverse shortest path length over all pairs of nodes (global metric).
+        """
+        _, distances = self.shortest_paths(graph)
+        return PathMetrics.global_efficiency(distances)
 
     def node_degree_centrality(self, graph):
         """
         Calculates degree centrality for each node (node-level metric).
         """
-        return nx.degree_centrality(graph)
+        return nx.degree_centrality(self.networkx_graph(graph))
 
     def node_clustering_coefficient(self, graph):
         """
         Calculates local clustering coefficient for each node (node-level metric).
         """
-        return nx.clustering(graph)
+        return nx.clustering(self.networkx_graph(graph))
 
-    def calculate_global_metrics(self, graph):
+    def node_weighted_clustering_coefficient(self, graph):
         """
-        Iterates through the registered global metrics and calculates them for a given graph.
+        Calculates the weighted (Onnela) local clustering coefficient for each node (node-level metric).
+        """
+        return nx.clustering(self.networkx_graph(graph), weight='weight')
+
+    def node_strength(self, graph):
+        """
+        Calculates the strength (sum of edge weights) of each node (node-level metric).
+        """
+        return dict(self.networkx_graph(graph).degree(weight='weight'))
+
+    def matrix_global_clustering_coefficient(self, graph):
+        """
+        Calculates the global clustering coefficient (transitivity) from the adjacency matrix (global metric).
         """
+        _, adjacency = self.adjacency(graph)
+        return MatrixMetrics.transitivity(adjacency)
+
+    def matrix_node_degree_centrality(self, graph):
+        """
+        Calculates degree centrality for each node from the adjacency matrix (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        return dict(zip(nodes, MatrixMetrics.degree_centrality(adjacency).tolist()))
+
+    def matrix_node_clustering_coefficient(self, graph):
+        """
+        Calculates local clustering coefficient for each node from the adjacency matrix (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        return dict(zip(nodes, MatrixMetrics.clustering(adjacency).tolist()))
+
+    def matrix_node_weighted_clustering_coefficient(self, graph):
+        """
+        Calculates the weighted (Onnela) local clustering coefficient for each node from the adjacency matrix
+        (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        return dict(zip(nodes, MatrixMetrics.weighted_clustering(adjacency).tolist()))
+
+    def matrix_node_strength(self, graph):
+        """
+        Calculates the strength (sum of edge weights) of each node from the adjacency matrix (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        return dict(zip(nodes, MatrixMetrics.strength(adjacency).tolist()))
+
+    def node_participation_coefficient(self, graph, restarts=None, seed=None):
+        """
+        Calculates the participation coefficient of each node over the Louvain modules (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        partition = self.partition(graph, restarts, seed)
+        communities = [partition[node] for node in nodes]
+        return dict(zip(nodes, Modularity.participation_coefficient(adjacency, communities).tolist()))
+
+    def node_within_module_degree(self, graph, restarts=None, seed=None):
+        """
+        Calculates the within-module degree z-score of each node over the Louvain modules (node-level metric).
+        """
+        nodes, adjacency = self.adjacency(graph)
+        partition = self.partition(graph, restarts, seed)
+        communities = [partition[node] for node in nodes]
+        return dict(zip(nodes, Modularity.within_module_degree(adjacency, communities).tolist()))
+
+    def node_closeness_centrality(self, graph):
+        """
+        Calculates closeness centrality for each node over the shortest path lengths (node-level metric).
+        """
+        nodes, _ = self.adjacency(graph)
+        _, distances = self.shortest_paths(graph)
+        return dict(zip(nodes, PathMetrics.closeness_centrality(distances).tolist()))
+
+    def node_betweenness_centrality(self, graph):
+        """
+        Calculates betweenness centrality for each node over the shortest path lengths (node-level metric).
+        """
+        nodes, _ = self.adjacency(graph)
+        lengths, distances = self.shortest_paths(graph)
+        return dict(zip(nodes, PathMetrics.betweenness_centrality(lengths, distances).tolist()))
+
+    def node_local_efficiency(self, graph):
+        """
+        Calculates the efficiency of the neighbourhood of each node (node-level metric).
+        """
+        nodes, _ = self.adjacency(graph)
+        lengths, _ = self.shortest_paths(graph)
+        return dict(zip(nodes, PathMetrics.local_efficiency(lengths).tolist()))
+
+    def calculate_batch_metrics(self, keys=None, pad=False, batch_size=None):
+        """
+        Calculates degree centrality, strength, clustering and transitivity for many graphs at once.
+        The adjacency matrices of graphs with the same number of nodes are stacked and evaluated together
+        with batched matrix products (or every graph is zero-padded to one stack with pad=True).
+        Returns a dictionary in the same layout as graph_metrics.pkl, holding only these metrics.
+        """
+        keys = list(self.metadata.keys()) if keys is None else list(keys)
+
+        node_lists = []
+        adjacencies = []
+        for key in keys:
+            graph = self.load_graph(self.metadata[key], key)
+            nodes, adjacency = MatrixMetrics.to_adjacency(graph)
+            node_lists.append(nodes)
+            adjacencies.append(adjacency)
+
+        all_metrics = {}
+        for key, nodes, metrics in zip(keys, node_lists, MatrixMetrics.batch_metrics(adjacencies, pad, batch_size)):
+            all_metrics[key] = {
+                'global_metrics': {
+                    'global_clustering_coefficient': metrics['transitivity'],
+                },
+                'node_metrics': {
+                    'degree_centrality': dict(zip(nodes, metrics['degree_centrality'].tolist())),
+                    'strength': dict(zip(nodes, metrics['strength'].tolist())),
+                    'clustering_coefficient': dict(zip(nodes, metrics['clustering'].tolist())),
+                }
+            }
+        return all_metrics
+
+    def calculate_registered_metrics(self, registry, graph, graph_digest=None):
+        """
+        Calculates the metrics of a registry for a given graph.
+        With a cache, metrics already calculated for the same graph content, parameters and code are reused.
+        """
+        if self.cache is not None and graph_digest is None:
+            graph_digest = graph_hash(graph)
+
         results = {}
-        for metric_name, metric_func in self.global_metrics_registry.items():
-            try:
-                results[metric_name] = metric_func(graph)
-            except Exception as e:
-                results[metric_name] = f"Error: {e}"
+        for metric_name, metric_func in registry.items():
+            if self.cache is not None:
+                cache_key = self.cache.metric_key(graph_digest, metric_name, metric_func)
+                hit, value = self.cache.get(cache_key)
+                if hit:
+                    results[metric_name] = value
+                    continue
+
+            with measure(self.profiler, 'metric', self.current_key, metric_name) as record:
+                try:
+                    results[metric_name] = metric_func(graph)
+                except Exception as e:
+                    results[metric_name] = f"Error: {e}"
+                    record['Error'] = str(e)
+            if record.get('Error') is not None:
+                continue
+
+            if self.cache is not None:
+                self.cache.set(cache_key, results[metric_name])
         return results
 
-    def calculate_node_metrics(self, graph):
+    def calculate_global_metrics(self, graph, graph_digest=None):
+        """
+        Iterates through the registered global metrics and calculates them for a given graph.
+        """
+        return self.calculate_registered_metrics(self.global_metrics_registry, graph, graph_digest)
+
+    def calculate_node_metrics(self, graph, graph_digest=None):
         """
         Iterates through the registered node-level metrics and calculates them for each node in the graph.
         """
-        results = {}
-        for metric_name, metric_func in self.node_metrics_registry.items():
-            try:
-                results[metric_name] = metric_func(graph)
-            except Exception as e:
-                results[metric_name] = f"Error: {e}"
-        return results
+        return self.calculate_registered_metrics(self.node_metrics_registry, graph, graph_digest)
+
+    def load_graph(self, graph_file, key=None):
+        """
+        Loads a graph from its GraphML file, or from a binary graph store (.npz) using its key.
+        With sparse_graphs the graph is returned as a SparseGraph.
+        """
+        with measure(self.profiler, 'load_graph', key):
+            if graph_file.endswith('.npz'):
+                if graph_file not in self.graph_stores:
+                    self.graph_stores[graph_file] = GraphStore(graph_file)
+                if self.sparse_graphs:
+                    return self.graph_stores[graph_file].get_sparse_graph(key)
+                return self.graph_stores[graph_file].get_graph(key)
+            graph = nx.read_graphml(graph_file)
+            return SparseGraph.from_networkx(graph) if self.sparse_graphs else graph
+
+    def calculate_metrics(self, graph, key=None):
+        """
+        Calculates both global and node-level metrics for a given graph.
+        The key identifies the graph to the metrics that keep per-graph state, like the Louvain partitions.
+        """
+        self.current_key = key
+        with measure(self.profiler, 'graph', key):
+            # The graph content is hashed once and shared by the global and node-level cache lookups
+            graph_digest = graph_hash(graph) if self.cache is not None else None
+            return {
+                'global_metrics': self.calculate_global_metrics(graph, graph_digest),
+                'node_metrics': self.calculate_node_metrics(graph, graph_digest)
+            }
+
+    def print_metrics(self, key, metrics):
+        """
+        Prints the global and node-level metrics calculated for a graph.
+        """
+        # Unpack the key
+        subject, state, wavelength = key
+
+        print(f"Calculating metrics for Subject: {subject}, State: {state}, Wavelength: {wavelength.name}")
+
+        print("\nGlobal Metrics:")
+        for metric_name, value in metrics['global_metrics'].items():
+            print(f"  {metric_name}: {value}")
+
+        print("\nNode-Level Metrics:")
+        for metric_name, node_values in metrics['node_metrics'].items():
+            values_array = [f"{value:.4f}" for node, value in node_values.items()]
+            print(f"  {metric_name}: [{', '.join(values_array)}]")
 
-    def iterate_and_calculate_metrics(self):
+    def iterate_and_calculate_metrics(self, workers=1, chunksize=4, output_file='graph_metrics.pkl',
+                                      table_directory='graph_metrics_table', keys=None, existing_metrics=None):
         """
         Iterates over all graphs, calculates both global and node-level metrics, prints results,
         and stores them in a dictionary.
+        The metrics are also saved as a columnar MetricsTable in `table_directory` (skipped when None).
+        With workers > 1 the graphs are split into chunks of `chunksize` graphs that are processed by a
+        process pool, and the results are printed as soon as each chunk is done.
+        `keys` restricts the calculation to some of the graphs. Their metrics are merged into
+        `existing_metrics` (metrics of graphs calculated earlier, for the other keys of the metadata) before
+        everything is saved.
+        With a profiler, the calculation and the saving are measured as the 'metrics' and 'save_metrics'
+        stages, and the records of the worker processes are merged into it.
         """
         all_metrics = {}
+        keys = list(self.metadata.keys()) if keys is None else list(keys)
 
-        for key, graph_file in self.metadata.items():
-            # Load the graph from the GraphML file
-            graph = nx.read_graphml(graph_file)
+        with measure(self.profiler, 'metrics'):
+            if workers > 1:
+                chunks = [keys[i:i + chunksize] for i in range(0, len(keys), chunksize)]
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                         initargs=(self,)) as executor:
+                    futures = {executor.submit(_calculate_chunk, [(key, self.metadata[key]) for key in chunk]):
+                               chunk for chunk in chunks}
+                    for future in as_completed(futures):
+                        results, records = future.result()
+                        if self.profiler is not None:
+                            self.profiler.merge(records)
+                        for key, (metrics, partition_entry) in zip(futures[future], results):
+                            self.print_metrics(key, metrics)
+                            all_metrics[key] = metrics
+                            if partition_entry is not None:
+                                self.partitions[self.partition_key(key)] = partition_entry
 
-            # Unpack the key
-            subject, state, wavelength = key
+                # Keep the same key order as the metadata, whatever order the chunks finished in
+                all_metrics = {key: all_metrics[key] for key in keys}
+            else:
+                for key in keys:
+                    # Load the graph and calculate both global and node-level metrics
+                    graph = self.load_graph(self.metadata[key], key)
+                    metrics = self.calculate_metrics(graph, key)
+                    self.print_metrics(key, metrics)
+                    all_metrics[key] = metrics
 
-            print(f"Calculating metrics for Subject: {subject}, State: {state}, Wavelength: {wavelength.name}")
+        # Merge the new metrics into the earlier ones, in the order of the metadata
+        if existing_metrics is not None:
+            merged = {key: all_metrics.get(key, existing_metrics.get(key)) for key in self.metadata}
+            all_metrics = {key: metrics for key, metrics in merged.items() if metrics is not None}
 
-            # Calculate global metrics
-            global_metrics = self.calculate_global_metrics(graph)
-            print("\nGlobal Metrics:")
-            for metric_name, value in global_metrics.items():
-                print(f"  {metric_name}: {value}")
+        with measure(self.profiler, 'save_metrics'):
+            # Save the calculated metrics to a .pkl file
+            with open(output_file, 'wb') as file:
+                pickle.dump(all_metrics, file)
 
-            # Calculate node-level metrics
-            node_metrics = self.calculate_node_metrics(graph)
-            print("\nNode-Level Metrics:")
-            for metric_name, node_values in node_metrics.items():
-                values_array = [f"{value:.4f}" for node, value in node_values.items()]
-                print(f"  {metric_name}: [{', '.join(values_array)}]")
+            print(f"\nMetrics saved to '{output_file}'")
 
-            # Store both global and node-level metrics in the dictionary
-            all_metrics[key] = {
-                'global_metrics': global_metrics,
-                'node_metrics': node_metrics
-            }
+            # Save the Louvain partitions next to the metrics, so later runs can reuse them
+            if self.partitions_file is not None:
+                Modularity.save_partitions(self.partitions, self.partitions_file)
 
-        # Save the calculated metrics to a .pkl file
-        with open('graph_metrics.pkl', 'wb') as file:
-            pickle.dump(all_metrics, file)
+            # Save the columnar copy used for sliced queries
+            if table_directory is not None:
+                MetricsTable.from_metrics(all_metrics).save(table_directory)
+                print(f"Metrics table saved to '{table_directory}'")
+        if self.cache is not None and workers <= 1:
+            print(f"Metric cache: {self.cache.hits} hits, {self.cache.misses} misses")
 
-        print("\nMetrics saved to 'graph_metrics.pkl'")
+        return all_metrics
 
 
 if __name__ == "__main__":
-    graph_metrics = GraphMetrics('graph_metadata.pkl')
+    # The metric cache makes reruns only calculate new or changed metrics
+    graph_metrics = GraphMetrics('graph_metadata.pkl', cache=MetricCache('metric_cache'))
 
     # Calculate and print metrics
-    all_metrics = graph_metrics.iterate_and_calculate_metrics()
+    all_metrics = graph_metrics.iterate_and_calculate_metrics(workers=os.cpu_count())
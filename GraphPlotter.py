@@ -1,15 +1,22 @@
+import os
 import pickle
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import seaborn as sns
+from BinnedKDE import node_metric_distributions
+from FigureRenderer import finish_figure, prepare_axes, prepare_figure
+from MetricsTable import MetricsTable
 
 class GraphPlotter:
     def __init__(self, metrics_file):
         """
         Initializes the GraphPlotter class by loading the metrics file.
+        The metrics file is either graph_metrics.pkl or a saved MetricsTable directory.
         """
-        self.metrics = self.load_metrics(metrics_file)
+        if os.path.isdir(metrics_file):
+            self.metrics = None
+            self.table = MetricsTable.load(metrics_file)
+        else:
+            self.metrics = self.load_metrics(metrics_file)
+            self.table = MetricsTable.from_metrics(self.metrics)
 
     def load_metrics(self, filename):
         """
@@ -27,45 +34,15 @@ class GraphPlotter:
         """
         Extracts the global metric values (GCC in this case) for each wavelength and state.
         """
-        data = []
+        df = self.table.query_global(metric_name, as_frame=True)
+        return df[['Subject', 'State', 'Wavelength', 'Value']].rename(columns={'Value': 'GCC'})
 
-        # Loop through all subjects and extract the global metric (GCC) for rest and film states
-        for (subject, state, wavelength), metrics in self.metrics.items():
-            # # Debugging: Print subject, state, and wavelength to check iteration
-            # print(f"Subject: {subject}, State: {state}, Wavelength: {wavelength.name}")
-
-            if metric_name in metrics['global_metrics']:
-                data.append({
-                    'Subject': subject,
-                    'State': state,
-                    'Wavelength': wavelength.name,
-                    'GCC': metrics['global_metrics'][metric_name]
-                })
-
-        # Convert the collected data into a pandas DataFrame
-        return pd.DataFrame(data)
-
-    def extract_node_gcc(self):
+    def node_metric_distributions(self, metric_name, cache_directory='kde_cache'):
         """
-        Extracts node-based GCC values for each wavelength and state.
+        Precomputes (and caches) the histogram and binned KDE of a node-level metric for every wavelength
+        and state, straight from the metric arrays of the table (see BinnedKDE).
         """
-        data = []
-
-        # Loop through all subjects and extract node-level GCC for rest and film states
-        for (subject, state, wavelength), metrics in self.metrics.items():
-            if 'clustering_coefficient' in metrics['node_metrics']:
-                # Get node-level GCC values and add them to the data list
-                for node, gcc_value in metrics['node_metrics']['clustering_coefficient'].items():
-                    data.append({
-                        'Subject': subject,
-                        'State': state,
-                        'Wavelength': wavelength.name,
-                        'Node': node,
-                        'Node_GCC': gcc_value
-                    })
-
-        # Convert the collected data into a pandas DataFrame
-        return pd.DataFrame(data)
+        return node_metric_distributions(self.table, metric_name, cache_directory)
 
     def calculate_mean_gcc(self, df):
         """
@@ -77,57 +54,97 @@ class GraphPlotter:
         """
         Extracts node-based GCC values and calculates the mean for each wavelength and state.
         """
-        data = []
+        # Mean node GCC of every subject, wavelength and state
+        df = self.table.query_node('clustering_coefficient', as_frame=True)
+        mean_df = df.groupby(['Subject', 'State', 'Wavelength'], sort=False)['Value'].mean().reset_index()
+        return mean_df[['Wavelength', 'State', 'Value']].rename(columns={'Value': 'Mean_Node_GCC'})
 
-        # Loop through all subjects and extract node-level GCC for rest and film states
-        for (subject, state, wavelength), metrics in self.metrics.items():
-            if 'clustering_coefficient' in metrics['node_metrics']:
-                # Get node-level GCC values and calculate the mean for this subject, wavelength, and state
-                node_gcc_values = list(metrics['node_metrics']['clustering_coefficient'].values())
-                mean_gcc = np.mean(node_gcc_values)
+    def calculate_mean_global_metric(self, metric_name):
+        """
+        Calculates the mean of a global metric for each wavelength and state.
+        """
+        df = self.table.query_global(metric_name, as_frame=True)
+        return df.groupby(['Wavelength', 'State'])['Value'].mean().reset_index()
 
-                # Append the mean GCC value to the data list
-                data.append({
-                    'Wavelength': wavelength.name,
-                    'State': state,
-                    'Mean_Node_GCC': mean_gcc
-                })
+    def plot_gcc_histogram(self, mean_gcc_df, save_path=None, fig=None):
+        """
+        Plots a histogram to compare the mean GCC values for rest and film across wavelengths.
+        With a save path the figure is written to disk instead of shown, and a figure passed in is reused.
+        """
+        reused = fig is not None
+        fig, ax = prepare_axes(fig, (10, 6))
+        sns.barplot(data=mean_gcc_df, x='Wavelength', y='GCC', hue='State', ax=ax)
+        ax.set_title("Mean Global Clustering Coefficient by Wavelength and State")
+        ax.set_ylabel("Mean GCC")
+        fig.tight_layout()
+        finish_figure(fig, save_path, reused)
 
-        # Convert the collected data into a pandas DataFrame
-        return pd.DataFrame(data)
+    @staticmethod
+    def plot_mean_global_metric(mean_df, metric_name, save_path=None, fig=None):
+        """
+        Plots the mean of any global metric for rest and film across wavelengths.
+        """
+        reused = fig is not None
+        fig, ax = prepare_axes(fig, (10, 6))
+        sns.barplot(data=mean_df, x='Wavelength', y='Value', hue='State', ax=ax)
+        ax.set_title(f"Mean {metric_name} by Wavelength and State")
+        ax.set_ylabel(f"Mean {metric_name}")
+        fig.tight_layout()
+        finish_figure(fig, save_path, reused)
 
-    def plot_gcc_histogram(self, mean_gcc_df):
+    @staticmethod
+    def plot_distribution_curves(ax, distributions, palette="Set1", alpha=0.5):
         """
-        Plots a histogram to compare the mean GCC values for rest and film across wavelengths.
+        Draws precomputed KDE curves on an axes, one filled curve per state.
+        `distributions` maps every state to its distribution (see BinnedKDE.distribution).
         """
-        plt.figure(figsize=(10, 6))
-        sns.barplot(data=mean_gcc_df, x='Wavelength', y='GCC', hue='State')
-        plt.title("Mean Global Clustering Coefficient by Wavelength and State")
-        plt.ylabel("Mean GCC")
-        plt.tight_layout()
-        plt.show()
+        colors = sns.color_palette(palette)
+        for i, (state, distribution) in enumerate(distributions.items()):
+            color = colors[i % len(colors)]
+            ax.plot(distribution['grid'], distribution['density'], color=color, label=state)
+            ax.fill_between(distribution['grid'], distribution['density'], color=color, alpha=alpha)
+        ax.legend(title='State')
 
-    def plot_node_gcc_distribution(self, df):
+    @staticmethod
+    def plot_node_gcc_distribution(distributions, save_path=None, fig=None):
         """
         Plots the distribution of node-based GCC for each wavelength, overlaid by state.
+        `distributions` are the precomputed node_metric_distributions of clustering_coefficient.
         """
-        plt.figure(figsize=(12, 8))
+        reused = fig is not None
+        fig = prepare_figure(fig, (12, 8))
 
         # Loop through each wavelength and create a subplot for it
-        wavelengths = df['Wavelength'].unique()
+        wavelengths = list(dict.fromkeys(wavelength for wavelength, _ in distributions))
         for i, wavelength in enumerate(wavelengths, 1):
-            plt.subplot(2, 3, i)  # Assuming 6 wavelengths (2 rows, 3 columns)
+            ax = fig.add_subplot(2, 3, i)  # Assuming 6 wavelengths (2 rows, 3 columns)
 
             # Plot distribution for the given wavelength, split by state, with overlay
-            sns.kdeplot(data=df[df['Wavelength'] == wavelength], x='Node_GCC', hue='State', fill=True,
-                        common_norm=False, palette="Set1", alpha=0.5)
+            GraphPlotter.plot_distribution_curves(
+                ax, {state: distribution for (band, state), distribution in distributions.items()
+                     if band == wavelength})
+
+            ax.set_title(f"Node GCC Distribution - {wavelength}")
+            ax.set_xlabel("Node GCC")
+            ax.set_ylabel("Density")
 
-            plt.title(f"Node GCC Distribution - {wavelength}")
-            plt.xlabel("Node GCC")
-            plt.ylabel("Density")
+        fig.tight_layout()
+        finish_figure(fig, save_path, reused)
 
-        plt.tight_layout()
-        plt.show()
+    @staticmethod
+    def plot_node_metric_distribution(distributions, metric_name, wavelength, save_path=None, fig=None):
+        """
+        Plots the precomputed distribution of a node-level metric for one wavelength, overlaid by state.
+        `distributions` maps every state to its distribution for that wavelength.
+        """
+        reused = fig is not None
+        fig, ax = prepare_axes(fig, (8, 5))
+        GraphPlotter.plot_distribution_curves(ax, distributions)
+        ax.set_title(f"{metric_name} Distribution - {wavelength}")
+        ax.set_xlabel(metric_name)
+        ax.set_ylabel("Density")
+        fig.tight_layout()
+        finish_figure(fig, save_path, reused)
 
 
 # Example usage
@@ -137,8 +154,8 @@ if __name__ == "__main__":
     mean_gcc_df = graph_plotter.calculate_mean_gcc(df)
     graph_plotter.plot_gcc_histogram(mean_gcc_df)
     # print(mean_gcc_df)
-    # Extract node-based GCC values
-    df = graph_plotter.extract_node_gcc()
+    # Precompute the node-based GCC distributions
+    distributions = graph_plotter.node_metric_distributions('clustering_coefficient')
 
     # Plot the distribution of node-based GCC for each wavelength and state
-    graph_plotter.plot_node_gcc_distribution(df)
\ No newline at end of file
+    graph_plotter.plot_node_gcc_distribution(distributions)
\ No newline at end of file
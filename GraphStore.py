@@ -0,0 +1,103 @@
+import numpy as np
+from EdgeThreshold import edges_to_graph
+from SparseGraph import SparseGraph
+
+
+def save_graph_store(edge_lists, filename):
+    """
+    Saves thresholded edge lists to a single binary .npz store.
+    `edge_lists` maps (subject, state, wavelength) to (rows, cols, weights, num_nodes), where rows and cols
+    are 0-based electrode indices. The edges of every graph are stored back to back in contiguous
+    int32/float32 arrays, and `offsets` tells where each graph starts.
+    """
+    keys = list(edge_lists.keys())
+    counts = [len(edge_lists[key][0]) for key in keys]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    def concatenate(position, dtype):
+        if not keys:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([np.asarray(edge_lists[key][position], dtype=dtype) for key in keys])
+
+    np.savez(
+        filename,
+        subjects=np.array([key[0] for key in keys], dtype=str),
+        states=np.array([key[1] for key in keys], dtype=str),
+        wavelengths=np.array([key[2].name for key in keys], dtype=str),
+        num_nodes=np.array([edge_lists[key][3] for key in keys], dtype=np.int32),
+        offsets=offsets,
+        rows=concatenate(0, np.int32),
+        cols=concatenate(1, np.int32),
+        weights=concatenate(2, np.float32),
+    )
+
+
+class GraphStore:
+    def __init__(self, filename):
+        """
+        Opens a binary graph store written by save_graph_store and indexes it by (subject, state, wavelength).
+        """
+        with np.load(filename) as data:
+            self.rows = data['rows']
+            self.cols = data['cols']
+            self.weights = data['weights']
+            self.offsets = data['offsets']
+            self.num_nodes = data['num_nodes']
+            subjects, states, wavelengths = data['subjects'], data['states'], data['wavelengths']
+
+        # Wavelengths are indexed by name, so keys built with any Wavelength enum can be used
+        self.index = {(str(subject), str(state), str(wavelength)): i
+                      for i, (subject, state, wavelength) in enumerate(zip(subjects, states, wavelengths))}
+
+    def _position(self, key):
+        """
+        Returns the position of a (subject, state, wavelength) key in the store.
+        """
+        subject, state, wavelength = key
+        return self.index[(subject, state, getattr(wavelength, 'name', wavelength))]
+
+    def __contains__(self, key):
+        try:
+            self._position(key)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        """
+        Returns the (subject, state, wavelength name) keys held in the store.
+        """
+        return list(self.index.keys())
+
+    def get_arrays(self, key):
+        """
+        Returns the raw (rows, cols, weights, num_nodes) arrays of a graph, as views into the store.
+        """
+        i = self._position(key)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.cols[start:end], self.weights[start:end], int(self.num_nodes[i])
+
+    def get_graph(self, key):
+        """
+        Returns a graph as an nx.Graph with integer node IDs numbered from 1 like the electrodes.
+        """
+        rows, cols, weights, _ = self.get_arrays(key)
+        return edges_to_graph(rows, cols, weights)
+
+    def get_sparse_graph(self, key):
+        """
+        Returns a graph as a SparseGraph, with the same node IDs and node order as get_graph.
+        """
+        rows, cols, weights, _ = self.get_arrays(key)
+        return SparseGraph.from_edges(rows, cols, weights)
+
+    def sparse_graphs(self):
+        """
+        Returns every graph of the store as a SparseGraph, by (subject, state, wavelength name) key, to hold
+        the whole cohort in memory for batch work.
+        """
+        return {key: self.get_sparse_graph(key) for key in self.keys()}
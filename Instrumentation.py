@@ -0,0 +1,203 @@
+import contextlib
+import cProfile
+import os
+import pstats
+import time
+import tracemalloc
+import pandas as pd
+
+COLUMNS = ['Stage', 'Subject', 'State', 'Wavelength', 'Metric', 'Wall_Seconds', 'CPU_Seconds', 'Peak_Memory_Bytes',
+           'Error']
+
+
+def measure(profiler, stage, key=None, metric=None):
+    """
+    Returns the block of a profiler measuring a stage, or a block that measures nothing without a profiler.
+    Lets the instrumented code run the same way whether it is profiled or not.
+    """
+    if profiler is None:
+        return contextlib.nullcontext({})
+    return profiler.measure(stage, key, metric)
+
+
+class Profiler:
+    def __init__(self, track_memory=False, profile=False):
+        """
+        Records the wall time, CPU time and, with track_memory, the peak memory allocated (tracemalloc) of
+        every measured block: pipeline stages, graph loading and every (subject, state, wavelength, metric).
+        With profile, the outermost measured blocks also run under cProfile, to see which functions inside
+        them take the time. Both are off by default because they slow the measured code down.
+        A profiler is sent along with the GraphMetrics instance to the worker processes. Their records are
+        sent back and merged, but cProfile only covers the process it runs in.
+        """
+        self.track_memory = track_memory
+        self.profile = profile
+        self.records = []
+        self.profile_stats = None  # pstats.Stats gathered by cProfile
+        self._profiler = None
+        self._stack = []  # [memory at start, highest peak seen] of every open block, innermost last
+
+    def __getstate__(self):
+        # A copy sent to a worker process starts empty: its records are sent back and merged. The cProfile
+        # profiler cannot be pickled, and open blocks belong to this process
+        state = self.__dict__.copy()
+        state['records'] = []
+        state['_profiler'] = None
+        state['profile_stats'] = None
+        state['_stack'] = []
+        return state
+
+    def worker_copy(self):
+        """
+        Returns an empty profiler with the same settings, for a worker process. A forked worker inherits the
+        records and open blocks of the parent, and its cProfile hook, which is switched off here.
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+        return Profiler(self.track_memory, self.profile)
+
+    @contextlib.contextmanager
+    def measure(self, stage, key=None, metric=None):
+        """
+        Measures the block it wraps and records it under the stage name, the (subject, state, wavelength)
+        key of the graph and the metric name, when given. An exception raised in the block is recorded
+        with the measurement and raised again; an error caught inside the block can be recorded by setting
+        'Error' in the record it yields.
+        Blocks can be nested: the peak memory of a block includes the blocks inside it.
+        """
+        subject, state, wavelength = key if key is not None else (None, None, None)
+        record = {
+            'Stage': stage,
+            'Subject': subject,
+            'State': state,
+            'Wavelength': getattr(wavelength, 'name', wavelength),
+            'Metric': metric,
+            'Error': None,
+        }
+
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([current, current])
+
+        outermost = self.profile and self._profiler is None
+        if outermost:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except Exception as e:
+            record['Error'] = str(e)
+            raise
+        finally:
+            record['Wall_Seconds'] = time.perf_counter() - wall
+            record['CPU_Seconds'] = time.process_time() - cpu
+
+            if outermost:
+                self._profiler.disable()
+                stats = pstats.Stats(self._profiler)
+                if self.profile_stats is None:
+                    self.profile_stats = stats
+                else:
+                    self.profile_stats.add(stats)
+                self._profiler = None
+
+            record['Peak_Memory_Bytes'] = None
+            if self.track_memory:
+                start, highest = self._stack.pop()
+                highest = max(highest, tracemalloc.get_traced_memory()[1])
+                record['Peak_Memory_Bytes'] = highest - start
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], highest)
+                tracemalloc.reset_peak()
+
+            self.records.append(record)
+
+    def drain(self):
+        """
+        Returns the records gathered so far and forgets them (used by the worker processes).
+        """
+        records, self.records = self.records, []
+        return records
+
+    def merge(self, records):
+        """
+        Adds the records of another profiler, for example one of a worker process.
+        """
+        self.records.extend(records)
+
+    def summary(self):
+        """
+        Returns a DataFrame with one row per measured block.
+        """
+        return pd.DataFrame(self.records, columns=COLUMNS)
+
+    def stage_summary(self):
+        """
+        Total, mean and maximum wall time of every stage, and its largest peak memory, slowest stage first.
+        """
+        df = self.summary()
+        summary = df.groupby('Stage').agg(Count=('Wall_Seconds', 'size'), Total_Seconds=('Wall_Seconds', 'sum'),
+                                          Mean_Seconds=('Wall_Seconds', 'mean'), Max_Seconds=('Wall_Seconds', 'max'),
+                                          CPU_Seconds=('CPU_Seconds', 'sum'),
+                                          Peak_Memory_Bytes=('Peak_Memory_Bytes', 'max'),
+                                          Errors=('Error', 'count'))
+        return summary.sort_values('Total_Seconds', ascending=False).reset_index()
+
+    def slowest_metrics(self, top=10):
+        """
+        The metrics (and statistical tests) that took the most time over all graphs, with their mean and
+        worst time per graph.
+        """
+        df = self.summary()
+        df = df[df['Metric'].notna()]
+        summary = df.groupby(['Stage', 'Metric']).agg(Count=('Wall_Seconds', 'size'),
+                                                      Total_Seconds=('Wall_Seconds', 'sum'),
+                                                      Mean_Seconds=('Wall_Seconds', 'mean'),
+                                                      Max_Seconds=('Wall_Seconds', 'max'),
+                                                      Peak_Memory_Bytes=('Peak_Memory_Bytes', 'max'),
+                                                      Errors=('Error', 'count'))
+        return summary.sort_values('Total_Seconds', ascending=False).head(top).reset_index()
+
+    def slowest_graphs(self, top=10):
+        """
+        The (subject, state, wavelength) graphs that took the most time, loading and metrics included.
+        The metric blocks are nested in the graph blocks, so they are not counted again.
+        """
+        df = self.summary()
+        df = df[df['Subject'].notna() & (df['Stage'] != 'metric')]
+        summary = df.groupby(['Subject', 'State', 'Wavelength']).agg(Total_Seconds=('Wall_Seconds', 'sum'),
+                                                                     Peak_Memory_Bytes=('Peak_Memory_Bytes', 'max'),
+                                                                     Errors=('Error', 'count'))
+        return summary.sort_values('Total_Seconds', ascending=False).head(top).reset_index()
+
+    def print_summary(self, top=10):
+        """
+        Prints the stages, the slowest metrics and the slowest graphs.
+        """
+        print("\nStages:")
+        print(self.stage_summary().to_string(index=False))
+        print(f"\nSlowest metrics (top {top}):")
+        print(self.slowest_metrics(top).to_string(index=False))
+        print(f"\nSlowest graphs (top {top}):")
+        print(self.slowest_graphs(top).to_string(index=False))
+
+    def save(self, directory='profiling'):
+        """
+        Saves every record and the summary tables as CSV files in `directory`, and the cProfile statistics
+        (readable with pstats or snakeviz) when they were captured.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.summary().to_csv(os.path.join(directory, 'records.csv'), index=False)
+        self.stage_summary().to_csv(os.path.join(directory, 'stages.csv'), index=False)
+        self.slowest_metrics(top=None).to_csv(os.path.join(directory, 'slowest_metrics.csv'), index=False)
+        self.slowest_graphs(top=None).to_csv(os.path.join(directory, 'slowest_graphs.csv'), index=False)
+        if self.profile_stats is not None:
+            self.profile_stats.dump_stats(os.path.join(directory, 'profile.prof'))
+        print(f"Profiling results saved to '{directory}'")
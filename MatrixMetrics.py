@@ -0,0 +1,167 @@
+import numpy as np
+import networkx as nx
+from scipy import sparse
+from SparseGraph import SparseGraph
+
+
+def to_adjacency(graph, weight='weight'):
+    """
+    Converts a graph to its weighted adjacency matrix.
+    Returns the node list (the order of the matrix rows) and the adjacency as a CSR matrix.
+    A SparseGraph already holds its adjacency and is not converted. A graph without nodes gets a 0 x 0 matrix.
+    """
+    if isinstance(graph, SparseGraph):
+        return list(graph.nodes), graph.to_adjacency()
+    nodes = list(graph.nodes)
+    if not nodes:
+        # NetworkX refuses to convert an empty graph
+        return nodes, sparse.csr_matrix((0, 0), dtype=float)
+    adjacency = nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=weight, format='csr')
+    return nodes, sparse.csr_matrix(adjacency, dtype=float)
+
+
+def binarize(adjacency):
+    """
+    Returns the binary (0/1) version of a weighted adjacency matrix.
+    """
+    binary = sparse.csr_matrix(adjacency, dtype=float, copy=True)
+    binary.eliminate_zeros()
+    binary.data[:] = 1.0
+    return binary
+
+
+def degree(adjacency):
+    """
+    Number of neighbours of every node.
+    """
+    return np.asarray(binarize(adjacency).sum(axis=1)).ravel()
+
+
+def strength(adjacency):
+    """
+    Sum of the edge weights of every node.
+    """
+    return np.asarray(sparse.csr_matrix(adjacency).sum(axis=1)).ravel()
+
+
+def degree_centrality(adjacency):
+    """
+    Degree of every node divided by the maximum possible degree (n - 1), like nx.degree_centrality.
+    """
+    num_nodes = adjacency.shape[0]
+    if num_nodes <= 1:
+        return np.ones(num_nodes)
+    return degree(adjacency) / (num_nodes - 1)
+
+
+def _closed_walks(matrix):
+    """
+    diag(M^3) for a symmetric sparse matrix, computed as the row sums of (M @ M) * M.
+    """
+    return np.asarray((matrix @ matrix).multiply(matrix).sum(axis=1)).ravel()
+
+
+def _normalize_by_triads(walks, degrees):
+    """
+    Divides the closed walks of every node by k(k - 1), nodes with fewer than 2 neighbours get 0.
+    """
+    triads = degrees * (degrees - 1)
+    clustering = np.zeros(len(degrees))
+    np.divide(walks, triads, out=clustering, where=triads > 0)
+    return clustering
+
+
+def clustering(adjacency):
+    """
+    Binary local clustering coefficient of every node: diag(A^3) / (k(k - 1)), like nx.clustering.
+    """
+    binary = binarize(adjacency)
+    return _normalize_by_triads(_closed_walks(binary), degree(binary))
+
+
+def weighted_clustering(adjacency):
+    """
+    Weighted (Onnela) local clustering coefficient of every node: diag(W^(1/3)^3) / (k(k - 1)), with the
+    weights normalized by the largest weight, like nx.clustering(graph, weight='weight').
+    """
+    weights = sparse.csr_matrix(adjacency, dtype=float, copy=True)
+    weights.eliminate_zeros()
+    if weights.nnz == 0:
+        return np.zeros(weights.shape[0])
+    weights.data = np.cbrt(weights.data / weights.data.max())
+    return _normalize_by_triads(_closed_walks(weights), degree(adjacency))
+
+
+def transitivity(adjacency):
+    """
+    Global clustering coefficient: trace(A^3) / sum(k(k - 1)), like nx.transitivity.
+    """
+    binary = binarize(adjacency)
+    triangles = _closed_walks(binary).sum()
+    degrees = degree(binary)
+    triads = (degrees * (degrees - 1)).sum()
+    return 0 if triangles == 0 else float(triangles / triads)
+
+
+def _stacked_metrics(weights):
+    """
+    Evaluates degree, strength, clustering and transitivity for a (graphs x n x n) stack of dense
+    weighted adjacency matrices with batched matrix products.
+    """
+    binary = (weights != 0).astype(float)
+    degrees = binary.sum(axis=-1)
+    strengths = weights.sum(axis=-1)
+
+    # diag(A^3) of every graph in one batched matmul
+    walks = np.einsum('gij,gij->gi', binary @ binary, binary)
+    triads = degrees * (degrees - 1)
+    clusterings = np.zeros_like(walks)
+    np.divide(walks, triads, out=clusterings, where=triads > 0)
+
+    total_walks = walks.sum(axis=-1)
+    total_triads = triads.sum(axis=-1)
+    transitivities = np.zeros(len(weights))
+    np.divide(total_walks, total_triads, out=transitivities, where=total_walks > 0)
+
+    return degrees, strengths, clusterings, transitivities
+
+
+def batch_metrics(adjacencies, pad=False, batch_size=None):
+    """
+    Evaluates degree, degree centrality, strength, clustering and transitivity for many graphs at once.
+    Graphs with the same number of nodes are stacked into one (graphs x n x n) tensor and evaluated with
+    batched matrix products. With pad=True every graph is zero-padded to the largest node count instead, so
+    the whole cohort is a single stack (padding nodes are isolated and do not change the results).
+    `batch_size` caps the number of graphs stacked at once.
+    Returns a list with a dictionary of metrics per graph, in the order of `adjacencies`.
+    """
+    adjacencies = [adjacency.toarray() if sparse.issparse(adjacency) else np.asarray(adjacency, dtype=float)
+                   for adjacency in adjacencies]
+    sizes = [adjacency.shape[0] for adjacency in adjacencies]
+
+    # Bucket the graphs by node count (a single bucket when padding)
+    largest = max(sizes, default=0)
+    buckets = {}
+    for i, size in enumerate(sizes):
+        buckets.setdefault(largest if pad else size, []).append(i)
+
+    results = [None] * len(adjacencies)
+    for size, indices in buckets.items():
+        step = batch_size or len(indices)
+        for start in range(0, len(indices), step):
+            batch = indices[start:start + step]
+            weights = np.zeros((len(batch), size, size))
+            for position, i in enumerate(batch):
+                weights[position, :sizes[i], :sizes[i]] = adjacencies[i]
+
+            degrees, strengths, clusterings, transitivities = _stacked_metrics(weights)
+            for position, i in enumerate(batch):
+                n = sizes[i]
+                results[i] = {
+                    'degree': degrees[position, :n],
+                    'degree_centrality': degrees[position, :n] / (n - 1) if n > 1 else np.ones(n),
+                    'strength': strengths[position, :n],
+                    'clustering': clusterings[position, :n],
+                    'transitivity': float(transitivities[position]),
+                }
+    return results
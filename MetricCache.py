@@ -0,0 +1,207 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+CODE_VERSION = 1  # Bump to invalidate every cached metric at once
+
+
+def graph_hash(graph):
+    """
+    Calculates a content hash of a graph from its nodes and weighted edges.
+    Two graphs with the same nodes, edges and weights get the same hash, whatever their insertion order.
+    """
+    nodes = sorted(repr(node) for node in graph.nodes)
+    edges = []
+    for u, v, weight in graph.edges(data='weight'):
+        u, v = sorted((repr(u), repr(v)))
+        edges.append((u, v, repr(weight)))
+    edges.sort()
+
+    digest = hashlib.sha256()
+    digest.update(repr(nodes).encode())
+    digest.update(repr(edges).encode())
+    return digest.hexdigest()
+
+
+def metric_params(metric_func):
+    """
+    Returns the parameters a metric function was registered with (functools.partial keywords or a
+    `params` attribute).
+    """
+    if isinstance(metric_func, functools.partial):
+        return dict(metric_func.keywords)
+    return dict(getattr(metric_func, 'params', {}))
+
+
+@functools.lru_cache(maxsize=None)
+def module_version(filename):
+    """
+    Hash of the source file of a module, read once per process.
+    """
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def backing_modules(func):
+    """
+    Returns the project modules a metric function can call into, by name: the module that defines it
+    (with the helpers it uses, like GraphMetrics.partition or shortest_paths), and the modules it imports
+    that live next to it (like Modularity, PathMetrics or MatrixMetrics).
+    """
+    own_file = getattr(inspect.getmodule(func), '__file__', None)
+    if own_file is None:
+        return {}
+    directory = os.path.dirname(os.path.abspath(own_file))
+    modules = {func.__module__: own_file} if own_file.endswith('.py') else {}
+    for value in getattr(func, '__globals__', {}).values():
+        filename = getattr(value, '__file__', None) if inspect.ismodule(value) else None
+        if (filename is not None and filename.endswith('.py') and
+                os.path.dirname(os.path.abspath(filename)) == directory):
+            modules[value.__name__] = filename
+    return modules
+
+
+def metric_version(metric_func):
+    """
+    Returns the version of a metric function: its `version` attribute if it has one, otherwise a hash
+    of its source code and of the source of the project modules it calls into (see backing_modules),
+    so editing a metric or the code behind it invalidates its cached values.
+    """
+    version = getattr(metric_func, 'version', None)
+    if version is not None:
+        return str(version)
+
+    func = metric_func.func if isinstance(metric_func, functools.partial) else metric_func
+    func = getattr(func, '__func__', func)
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = getattr(func, '__qualname__', repr(func))
+
+    digest = hashlib.sha256(source.encode())
+    for name, filename in sorted(backing_modules(func).items()):
+        digest.update(f"{name}:{module_version(filename)}".encode())
+    return digest.hexdigest()
+
+
+class MetricCache:
+    def __init__(self, cache_directory='metric_cache', max_size=512 * 1024 ** 2):
+        """
+        Initializes a persistent metric cache stored as one Pickle file per entry in `cache_directory`.
+        When the cache grows beyond `max_size` bytes, the least recently used entries are evicted.
+        """
+        self.cache_directory = cache_directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_directory, exist_ok=True)
+        self.size = sum(size for _, _, size in self.entries())
+
+    def metric_key(self, graph_digest, metric_name, metric_func):
+        """
+        Builds the cache key of a metric from the graph hash, the metric name, its parameters and
+        the code version.
+        """
+        key = {
+            'graph': graph_digest,
+            'metric': metric_name,
+            'params': metric_params(metric_func),
+            'version': metric_version(metric_func),
+            'code_version': CODE_VERSION,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def path(self, key):
+        """
+        Returns the file path of a cache entry.
+        """
+        return os.path.join(self.cache_directory, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Looks up a cache entry. Returns (True, value) on a hit and (False, None) on a miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+
+        # Mark the entry as recently used for the eviction order. Another process sharing the cache may
+        # have evicted it in the meantime, which counts as a miss
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, value
+
+    def set(self, key, value):
+        """
+        Stores a cache entry, then evicts old entries if the cache is over its size limit.
+        """
+        path = self.path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(value, file)
+
+        # An entry that is overwritten no longer counts towards the size
+        try:
+            self.size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(temporary_path, path)
+
+        try:
+            self.size += os.path.getsize(path)
+        except OSError:
+            pass
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        """
+        Returns (path, last use time, size) for every entry in the cache.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_directory):
+            if entry.name.endswith('.pkl'):
+                # Skip the entries removed by another process since the directory was listed
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in its size limit.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def clear(self):
+        """
+        Removes every entry from the cache.
+        """
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        self.size = 0
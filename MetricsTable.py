@@ -0,0 +1,177 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from shared import Wavelength
+
+COLUMNS = ('subject', 'state', 'wavelength', 'node', 'value')
+GLOBAL_NODE = -1  # Node value of the rows holding global metrics
+
+
+def _as_float(value):
+    """Converts a metric value to float, errors stored as strings become NaN."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class MetricsTable:
+    def __init__(self, columns, subjects, states, groups):
+        """
+        Initializes a columnar metrics table.
+        `columns` holds the typed subject/state/wavelength/node/value arrays, sorted so that every
+        (kind, metric, state, wavelength) group is a contiguous slice, and `groups` maps each group to
+        its (start, end) slice. Subjects and states are stored as codes into the `subjects` and `states` lists.
+        """
+        self.columns = columns
+        self.subjects = list(subjects)
+        self.states = list(states)
+        self.groups = groups
+
+    @classmethod
+    def from_metrics(cls, all_metrics):
+        """
+        Builds a metrics table from the nested dictionary saved in graph_metrics.pkl.
+        """
+        subjects = sorted({key[0] for key in all_metrics})
+        states = sorted({key[1] for key in all_metrics})
+        subject_codes = {subject: i for i, subject in enumerate(subjects)}
+        state_codes = {state: i for i, state in enumerate(states)}
+
+        rows = {'kind': [], 'metric': [], 'subject': [], 'state': [], 'wavelength': [], 'node': [], 'value': []}
+
+        def add_rows(kind, metric_name, subject, state, wavelength, nodes, values):
+            rows['kind'].extend([kind] * len(values))
+            rows['metric'].extend([metric_name] * len(values))
+            rows['subject'].extend([subject_codes[subject]] * len(values))
+            rows['state'].extend([state_codes[state]] * len(values))
+            rows['wavelength'].extend([wavelength.value] * len(values))
+            rows['node'].extend(nodes)
+            rows['value'].extend(values)
+
+        for (subject, state, wavelength), metrics in all_metrics.items():
+            for metric_name, value in metrics['global_metrics'].items():
+                add_rows('global', metric_name, subject, state, wavelength, [GLOBAL_NODE], [_as_float(value)])
+            for metric_name, node_values in metrics['node_metrics'].items():
+                if isinstance(node_values, dict):
+                    add_rows('node', metric_name, subject, state, wavelength,
+                             [int(node) for node in node_values], [_as_float(v) for v in node_values.values()])
+
+        kinds = np.array(rows['kind'], dtype=str)
+        metrics = np.array(rows['metric'], dtype=str)
+        columns = {
+            'subject': np.array(rows['subject'], dtype=np.int32),
+            'state': np.array(rows['state'], dtype=np.int8),
+            'wavelength': np.array(rows['wavelength'], dtype=np.int8),
+            'node': np.array(rows['node'], dtype=np.int32),
+            'value': np.array(rows['value'], dtype=np.float64),
+        }
+
+        # Sort the rows so every (kind, metric, state, wavelength) group is contiguous
+        order = np.lexsort((columns['node'], columns['subject'], columns['wavelength'], columns['state'],
+                            metrics, kinds))
+        kinds, metrics = kinds[order], metrics[order]
+        columns = {name: column[order] for name, column in columns.items()}
+
+        groups = {}
+        if order.size:
+            boundaries = np.flatnonzero((kinds[1:] != kinds[:-1]) | (metrics[1:] != metrics[:-1]) |
+                                        (columns['state'][1:] != columns['state'][:-1]) |
+                                        (columns['wavelength'][1:] != columns['wavelength'][:-1])) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [order.size]))
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                group = (str(kinds[start]), str(metrics[start]), int(columns['state'][start]),
+                         int(columns['wavelength'][start]))
+                groups[group] = (start, end)
+
+        return cls(columns, subjects, states, groups)
+
+    def save(self, directory):
+        """
+        Saves the table as one .npy file per column plus an index.json describing the groups.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in COLUMNS:
+            np.save(os.path.join(directory, f"{name}.npy"), self.columns[name])
+
+        index = {
+            'subjects': self.subjects,
+            'states': self.states,
+            'groups': [[kind, metric, state, wavelength, start, end]
+                       for (kind, metric, state, wavelength), (start, end) in self.groups.items()],
+        }
+        with open(os.path.join(directory, 'index.json'), 'w') as file:
+            json.dump(index, file)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens a saved table. The columns are memory-mapped, so only the slices that are queried are read.
+        """
+        with open(os.path.join(directory, 'index.json'), 'r') as file:
+            index = json.load(file)
+
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in COLUMNS}
+        groups = {(kind, metric, state, wavelength): (start, end)
+                  for kind, metric, state, wavelength, start, end in index['groups']}
+        return cls(columns, index['subjects'], index['states'], groups)
+
+    def _code(self, vocabulary, value):
+        """
+        Returns the code of a subject or state, or -1 when it is not in the table.
+        """
+        return vocabulary.index(value) if value in vocabulary else -1
+
+    def metric_names(self, kind):
+        """
+        Returns the names of the 'global' or 'node' metrics held in the table.
+        """
+        return sorted({metric for group_kind, metric, _, _ in self.groups if group_kind == kind})
+
+    def query(self, kind, metric_name, state=None, wavelength=None, subject=None, as_frame=False):
+        """
+        Returns the rows of one 'global' or 'node' metric, optionally restricted to a state, a wavelength
+        and a subject. Only the matching groups are sliced, so the cost scales with the size of the result.
+        Returns a dictionary of NumPy arrays, or a DataFrame when `as_frame` is True.
+        """
+        state_code = None if state is None else self._code(self.states, state)
+        wavelength_value = None if wavelength is None else getattr(wavelength, 'value', wavelength)
+
+        slices = [(start, end) for (group_kind, group_metric, group_state, group_wavelength), (start, end)
+                  in self.groups.items()
+                  if group_kind == kind and group_metric == metric_name
+                  and (state_code is None or group_state == state_code)
+                  and (wavelength_value is None or group_wavelength == wavelength_value)]
+
+        result = {}
+        for name in COLUMNS:
+            parts = [np.asarray(self.columns[name][start:end]) for start, end in slices]
+            result[name] = np.concatenate(parts) if parts else np.empty(0, dtype=self.columns[name].dtype)
+
+        if subject is not None:
+            mask = result['subject'] == self._code(self.subjects, subject)
+            result = {name: column[mask] for name, column in result.items()}
+
+        if as_frame:
+            return pd.DataFrame({
+                'Subject': np.array(self.subjects, dtype=object)[result['subject']],
+                'State': np.array(self.states, dtype=object)[result['state']],
+                'Wavelength': [Wavelength(value).name for value in result['wavelength'].tolist()],
+                'Node': result['node'],
+                'Value': result['value'],
+            })
+        return result
+
+    def query_global(self, metric_name, state=None, wavelength=None, subject=None, as_frame=False):
+        """
+        Returns the values of a global metric (see query).
+        """
+        return self.query('global', metric_name, state, wavelength, subject, as_frame)
+
+    def query_node(self, metric_name, state=None, wavelength=None, subject=None, as_frame=False):
+        """
+        Returns the values of a node-level metric (see query).
+        """
+        return self.query('node', metric_name, state, wavelength, subject, as_frame)
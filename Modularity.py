@@ -0,0 +1,111 @@
+import os
+import pickle
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+import MatrixMetrics
+
+
+def complete_partition(partition, graph):
+    """
+    Adapts a partition to the nodes of a graph: nodes the graph does not have are dropped and nodes
+    the partition does not cover get their own community. Used to warm-start Louvain from a partition
+    computed on another graph of the same electrodes.
+    """
+    completed = {node: partition[node] for node in graph.nodes if node in partition}
+    next_community = max(completed.values(), default=-1) + 1
+    for node in graph.nodes:
+        if node not in completed:
+            completed[node] = next_community
+            next_community += 1
+    return completed
+
+
+def _louvain_run(graph, seed, warm_start=None):
+    """
+    Runs Louvain once with a fixed seed. Returns the partition and its modularity.
+    """
+    import community
+    partition = community.best_partition(graph, partition=warm_start, random_state=seed)
+    return partition, community.modularity(partition, graph)
+
+
+def best_partition(graph, restarts=10, seed=0, workers=1, warm_start=None):
+    """
+    Runs `restarts` seeded Louvain runs and keeps the partition with the highest modularity.
+    The seeds are seed, seed + 1, ..., so the result is reproducible. With a warm start, the first run
+    starts from it (completed to the nodes of the graph) and the others start from scratch.
+    With workers > 1 the restarts run in a process pool.
+    Returns the best partition and its modularity.
+    """
+    seeds = [seed + i for i in range(restarts)]
+    warm_starts = [None] * restarts
+    if warm_start is not None and restarts > 0:
+        warm_starts[0] = complete_partition(warm_start, graph)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            runs = list(executor.map(_louvain_run, [graph] * restarts, seeds, warm_starts))
+    else:
+        runs = [_louvain_run(graph, run_seed, run_warm_start) for run_seed, run_warm_start in zip(seeds, warm_starts)]
+
+    # max keeps the first of equally good runs, so ties go to the lowest seed
+    return max(runs, key=lambda run: run[1])
+
+
+def module_degrees(adjacency, communities):
+    """
+    Returns, for every node, the number of its neighbours in each module (nodes x modules).
+    `communities` holds the module of every node, in the order of the adjacency rows.
+    """
+    _, labels = np.unique(communities, return_inverse=True)
+    membership = sparse.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)))
+    return np.asarray((MatrixMetrics.binarize(adjacency) @ membership).todense()), labels
+
+
+def participation_coefficient(adjacency, communities):
+    """
+    Participation coefficient of every node: 1 - sum over modules of (k_is / k_i)^2.
+    Nodes without neighbours get 0.
+    """
+    degrees_per_module, _ = module_degrees(adjacency, communities)
+    degrees = degrees_per_module.sum(axis=1)
+    participation = np.zeros(len(degrees))
+    connected = degrees > 0
+    participation[connected] = 1 - ((degrees_per_module[connected] / degrees[connected, np.newaxis]) ** 2).sum(axis=1)
+    return participation
+
+
+def within_module_degree(adjacency, communities):
+    """
+    Within-module degree z-score of every node: how many more neighbours it has in its own module than the
+    average node of that module, in standard deviations. Modules with no spread get 0.
+    """
+    degrees_per_module, labels = module_degrees(adjacency, communities)
+    own_degrees = degrees_per_module[np.arange(len(labels)), labels]
+
+    z_scores = np.zeros(len(labels))
+    for module in range(labels.max() + 1 if len(labels) else 0):
+        members = labels == module
+        std = own_degrees[members].std()
+        if std > 0:
+            z_scores[members] = (own_degrees[members] - own_degrees[members].mean()) / std
+    return z_scores
+
+
+def save_partitions(partitions, filename='graph_partitions.pkl'):
+    """
+    Saves the partitions to a Pickle file.
+    """
+    with open(filename, 'wb') as file:
+        pickle.dump(partitions, file)
+
+
+def load_partitions(filename='graph_partitions.pkl'):
+    """
+    Loads the partitions from a Pickle file, or returns an empty dictionary if it does not exist.
+    """
+    if filename is None or not os.path.exists(filename):
+        return {}
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
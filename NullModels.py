@@ -0,0 +1,187 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.sparse import csgraph
+import MatrixMetrics
+
+
+def edge_arrays(adjacency):
+    """
+    Returns the (u, v) node index arrays of the edges of a symmetric adjacency matrix, with u < v.
+    """
+    upper = sparse.triu(sparse.csr_matrix(adjacency), k=1).tocoo()
+    keep = upper.data != 0
+    return upper.row[keep].astype(np.int64), upper.col[keep].astype(np.int64)
+
+
+def edges_to_adjacency(u, v, num_nodes):
+    """
+    Builds the binary CSR adjacency matrix of an edge list.
+    """
+    data = np.ones(2 * len(u))
+    return sparse.csr_matrix((data, (np.concatenate((u, v)), np.concatenate((v, u)))), shape=(num_nodes, num_nodes))
+
+
+def _ring_distance(i, j, num_nodes):
+    """Distance of the matrix cell (i, j) from the main diagonal, on a ring of num_nodes nodes."""
+    distance = np.abs(i - j)
+    return np.minimum(distance, num_nodes - distance)
+
+
+def rewire_edges(u, v, num_nodes, swaps_per_edge=10, rng=None, lattice=False, max_rounds=None, max_idle_rounds=10):
+    """
+    Degree-preserving (Maslov-Sneppen) rewiring of an edge list, with array operations.
+    Every round pairs up all the edges at random and proposes one double-edge swap per pair,
+    (a1, a2), (b1, b2) -> (a1, b2), (b1, a2). A swap is applied when it creates no self-loop, no edge that
+    already exists and no edge also created by another swap of the round; all valid swaps of a round are
+    applied at once. Rounds continue until swaps_per_edge swaps per edge were applied.
+    With lattice=True only swaps that move edges closer to the main diagonal are kept, which turns the graph
+    into a lattice with the same degree sequence. A random pairing often has no such swap while others do,
+    so latticization only stops early after `max_idle_rounds` rounds in a row without any swap.
+    Returns the rewired (u, v) arrays.
+    """
+    rng = np.random.default_rng(rng)
+    u, v = np.array(u, dtype=np.int64), np.array(v, dtype=np.int64)
+    num_edges = len(u)
+    if num_edges < 2:
+        return u, v
+
+    linked = np.zeros((num_nodes, num_nodes), dtype=bool)
+    linked[u, v] = linked[v, u] = True
+
+    target = swaps_per_edge * num_edges
+    max_rounds = max_rounds or 20 * swaps_per_edge + 10
+    swaps = 0
+    idle_rounds = 0
+    for _ in range(max_rounds):
+        if swaps >= target:
+            break
+
+        # Pair up the edges and pick the orientation of the second edge of each pair at random
+        order = rng.permutation(num_edges)
+        half = num_edges // 2
+        a, b = order[:half], order[half:2 * half]
+        flip = rng.random(half) < 0.5
+        a1, a2 = u[a], v[a]
+        b1, b2 = np.where(flip, v[b], u[b]), np.where(flip, u[b], v[b])
+
+        valid = (a1 != b2) & (b1 != a2) & ~linked[a1, b2] & ~linked[b1, a2]
+        if lattice:
+            before = _ring_distance(a1, a2, num_nodes) + _ring_distance(b1, b2, num_nodes)
+            after = _ring_distance(a1, b2, num_nodes) + _ring_distance(b1, a2, num_nodes)
+            valid &= after < before
+
+        # Two swaps of the round must not create the same edge
+        proposed = np.flatnonzero(valid)
+        created = np.concatenate((np.minimum(a1[proposed], b2[proposed]) * num_nodes +
+                                  np.maximum(a1[proposed], b2[proposed]),
+                                  np.minimum(b1[proposed], a2[proposed]) * num_nodes +
+                                  np.maximum(b1[proposed], a2[proposed])))
+        _, inverse, counts = np.unique(created, return_inverse=True, return_counts=True)
+        duplicated = counts[inverse] > 1
+        accepted = proposed[~(duplicated[:len(proposed)] | duplicated[len(proposed):])]
+        if accepted.size == 0:
+            idle_rounds += 1
+            if lattice and idle_rounds >= max_idle_rounds:
+                break
+            continue
+        idle_rounds = 0
+
+        a, b = a[accepted], b[accepted]
+        a1, a2, b1, b2 = a1[accepted], a2[accepted], b1[accepted], b2[accepted]
+        linked[a1, a2] = linked[a2, a1] = linked[b1, b2] = linked[b2, b1] = False
+        linked[a1, b2] = linked[b2, a1] = linked[b1, a2] = linked[a2, b1] = True
+        u[a], v[a] = np.minimum(a1, b2), np.maximum(a1, b2)
+        u[b], v[b] = np.minimum(b1, a2), np.maximum(b1, a2)
+        swaps += accepted.size
+
+    return u, v
+
+
+def clustering_and_path_length(adjacency):
+    """
+    Binary average clustering coefficient and characteristic path length of a graph.
+    The path length is averaged over the pairs of nodes that are connected, so it stays finite when the
+    graph has several components.
+    """
+    clustering = MatrixMetrics.clustering(adjacency).mean() if adjacency.shape[0] else 0.0
+    distances = csgraph.shortest_path(adjacency, unweighted=True, directed=False)
+    reachable = np.isfinite(distances) & ~np.eye(adjacency.shape[0], dtype=bool)
+    path_length = distances[reachable].mean() if reachable.any() else np.inf
+    return float(clustering), float(path_length)
+
+
+def _null_models(u, v, num_nodes, seeds, swaps_per_edge):
+    """
+    Builds a randomized and a lattice null model for every seed.
+    Returns a (len(seeds) x 3) array of random clustering, random path length and lattice clustering.
+    """
+    results = np.empty((len(seeds), 3))
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        random_u, random_v = rewire_edges(u, v, num_nodes, swaps_per_edge, rng)
+        results[i, :2] = clustering_and_path_length(edges_to_adjacency(random_u, random_v, num_nodes))
+        lattice_u, lattice_v = rewire_edges(u, v, num_nodes, swaps_per_edge, rng, lattice=True)
+        results[i, 2] = clustering_and_path_length(edges_to_adjacency(lattice_u, lattice_v, num_nodes))[0]
+    return results
+
+
+def _small_world_indices(clustering, path_length, nulls):
+    """
+    Combines the metrics of a graph with the mean metrics of its null models.
+    Like networkx's omega, the lattice clustering is raised to the clustering of the graph when the lattices
+    cluster less than it, so under-converged lattices do not bias omega negative.
+    """
+    random_clustering, random_path_length, lattice_clustering = nulls.mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized_clustering = clustering / random_clustering
+        normalized_path_length = path_length / random_path_length
+        return {
+            'clustering': clustering,
+            'path_length': path_length,
+            'normalized_clustering': float(normalized_clustering),
+            'normalized_path_length': float(normalized_path_length),
+            'sigma': float(normalized_clustering / normalized_path_length),
+            'omega': float(random_path_length / path_length - clustering / max(clustering, lattice_clustering)),
+        }
+
+
+def small_world_metrics_bulk(adjacencies, num_nulls=100, swaps_per_edge=10, seed=0, workers=1, chunk_size=10):
+    """
+    Calculates normalized clustering, normalized path length and the sigma/omega small-world indices of
+    many graphs, each against `num_nulls` degree-preserving randomized graphs and lattices.
+    The null models of all the graphs are spread over a process pool in chunks of `chunk_size` nulls.
+    Every null has its own seed derived from `seed`, so the result does not depend on the number of workers.
+    Returns a list with a dictionary of indices per graph.
+    """
+    jobs = []
+    observed = []
+    graph_seeds = np.random.SeedSequence(seed).spawn(len(adjacencies))
+    for g, adjacency in enumerate(adjacencies):
+        binary = MatrixMetrics.binarize(adjacency)
+        u, v = edge_arrays(binary)
+        observed.append(clustering_and_path_length(binary))
+        null_seeds = graph_seeds[g].spawn(num_nulls)
+        for start in range(0, num_nulls, chunk_size):
+            jobs.append((g, (u, v, binary.shape[0], null_seeds[start:start + chunk_size], swaps_per_edge)))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_null_models, *zip(*[args for _, args in jobs])))
+    else:
+        chunks = [_null_models(*args) for _, args in jobs]
+
+    nulls = [[] for _ in adjacencies]
+    for (g, _), chunk in zip(jobs, chunks):
+        nulls[g].append(chunk)
+
+    return [_small_world_indices(clustering, path_length, np.concatenate(graph_nulls))
+            for (clustering, path_length), graph_nulls in zip(observed, nulls)]
+
+
+def small_world_metrics(adjacency, num_nulls=100, swaps_per_edge=10, seed=0, workers=1):
+    """
+    Calculates normalized clustering, normalized path length and the sigma/omega small-world indices of a
+    single graph (see small_world_metrics_bulk).
+    """
+    return small_world_metrics_bulk([adjacency], num_nulls, swaps_per_edge, seed, workers)[0]
@@ -0,0 +1,144 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def length_matrix(adjacency):
+    """
+    Turns a weighted (coherence) adjacency matrix into edge lengths: strong connections are short,
+    so every edge gets length 1 / weight.
+    """
+    lengths = sparse.csr_matrix(adjacency, dtype=float, copy=True)
+    lengths.eliminate_zeros()
+    lengths.data = 1.0 / lengths.data
+    return lengths
+
+
+def distance_matrix(lengths):
+    """
+    All-pairs shortest path distances of an undirected graph given its edge lengths.
+    Nodes that cannot reach each other are at distance inf.
+    """
+    return csgraph.dijkstra(lengths, directed=False)
+
+
+def _reachable(distances):
+    """Mask of the pairs of distinct nodes that are connected by a path."""
+    return np.isfinite(distances) & ~np.eye(distances.shape[0], dtype=bool)
+
+
+def characteristic_path_length(distances):
+    """
+    Mean shortest path distance between the pairs of nodes that are connected. Pairs in different
+    components are left out, so the value stays finite for disconnected graphs (nan without any path).
+    """
+    reachable = _reachable(distances)
+    return float(distances[reachable].mean()) if reachable.any() else np.nan
+
+
+def _efficiency(distances):
+    """Mean inverse distance over all pairs of distinct nodes, unconnected pairs counting as 0."""
+    num_nodes = distances.shape[0]
+    if num_nodes < 2:
+        return 0.0
+    reachable = _reachable(distances)
+    return float((1.0 / distances[reachable]).sum() / (num_nodes * (num_nodes - 1)))
+
+
+def global_efficiency(distances):
+    """
+    Mean inverse shortest path distance over all pairs of nodes. Unconnected pairs count as 0, so
+    disconnected graphs need no special case.
+    """
+    return _efficiency(distances)
+
+
+def local_efficiency(lengths):
+    """
+    Efficiency of the subgraph of the neighbours of every node (the node itself removed), with
+    distances measured inside that subgraph.
+    """
+    lengths = sparse.csr_matrix(lengths)
+    efficiency = np.zeros(lengths.shape[0])
+    for node in range(lengths.shape[0]):
+        neighbours = lengths.indices[lengths.indptr[node]:lengths.indptr[node + 1]]
+        neighbours = neighbours[neighbours != node]
+        if len(neighbours) > 1:
+            efficiency[node] = _efficiency(distance_matrix(lengths[neighbours][:, neighbours]))
+    return efficiency
+
+
+def closeness_centrality(distances):
+    """
+    Closeness of every node: the number of nodes it reaches divided by the sum of the distances to them,
+    scaled by the fraction of the other nodes it reaches (Wasserman and Faust), like
+    nx.closeness_centrality. Isolated nodes get 0.
+    """
+    num_nodes = distances.shape[0]
+    reachable = _reachable(distances)
+    reached = reachable.sum(axis=1)
+    total = np.where(reachable, distances, 0.0).sum(axis=1)
+
+    closeness = np.zeros(num_nodes)
+    connected = total > 0
+    closeness[connected] = reached[connected] / total[connected]
+    if num_nodes > 1:
+        closeness *= reached / (num_nodes - 1)
+    return closeness
+
+
+def betweenness_centrality(lengths, distances, normalized=True, chunk_size=64, rtol=1e-10):
+    """
+    Betweenness of every node, accumulated over the shortest path DAGs of all the sources (Brandes),
+    vectorized over a chunk of sources at a time. An edge (v, w) lies on a shortest path from s when
+    d(s, v) + length(v, w) equals d(s, w) up to `rtol`, so equally short paths are all counted.
+    With normalized=True the values are divided by (n - 1)(n - 2), like nx.betweenness_centrality.
+    """
+    num_nodes = distances.shape[0]
+    betweenness = np.zeros(num_nodes)
+    if num_nodes < 3:
+        return betweenness
+
+    edges = sparse.triu(sparse.csr_matrix(lengths), k=1).tocoo()
+    tails = np.concatenate((edges.row, edges.col))
+    heads = np.concatenate((edges.col, edges.row))
+    edge_lengths = np.concatenate((edges.data, edges.data))
+
+    for start in range(0, num_nodes, chunk_size):
+        sources = np.arange(start, min(start + chunk_size, num_nodes))
+        rows = np.arange(len(sources))
+        source_distances = distances[sources]
+
+        # dag[s, v, w] is True when the edge v -> w lies on a shortest path from source s
+        through = source_distances[:, tails] + edge_lengths
+        on_path = np.isfinite(through) & np.isclose(through, source_distances[:, heads], rtol=rtol, atol=0)
+        dag = np.zeros((len(sources), num_nodes, num_nodes), dtype=bool)
+        chunk_index, edge_index = np.nonzero(on_path)
+        dag[chunk_index, tails[edge_index], heads[edge_index]] = True
+
+        # Nodes in order of distance from every source, the source first and unreachable nodes last
+        order = np.argsort(source_distances, axis=1, kind='stable')
+
+        # Number of shortest paths from the source to every node
+        paths = np.zeros((len(sources), num_nodes))
+        paths[rows, sources] = 1.0
+        for k in range(1, num_nodes):
+            nodes = order[:, k]
+            paths[rows, nodes] = (paths * dag[rows, :, nodes]).sum(axis=1)
+
+        # Dependencies accumulated from the farthest nodes back to the source
+        dependency = np.zeros((len(sources), num_nodes))
+        for k in range(num_nodes - 1, 0, -1):
+            nodes = order[:, k]
+            counted = paths[rows, nodes] > 0
+            share = np.zeros(len(sources))
+            share[counted] = (1.0 + dependency[rows[counted], nodes[counted]]) / paths[rows[counted], nodes[counted]]
+            dependency += dag[rows, :, nodes] * paths * share[:, np.newaxis]
+
+        dependency[rows, sources] = 0.0
+        betweenness += dependency.sum(axis=0)
+
+    if normalized:
+        return betweenness / ((num_nodes - 1) * (num_nodes - 2))
+    # Every path of an undirected graph is counted from both of its ends
+    return betweenness / 2
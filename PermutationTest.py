@@ -0,0 +1,101 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+def paired_t_statistics(sign_flips, differences, sum_squares, n):
+    """
+    Calculates the paired t-statistic of every test for a batch of sign flips in one matrix product.
+    `sign_flips` is (permutations x subjects) of +1/-1, `differences` is (subjects x tests) with missing
+    pairs set to 0, and `sum_squares` and `n` are the per-test sum of squared differences and pair count.
+    Flipping signs does not change the sum of squares, so only the sums have to be recomputed.
+    """
+    mean = (sign_flips @ differences) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (sum_squares - n * mean ** 2) / (n - 1)
+        return mean / np.sqrt(variance / n)
+
+
+def _tail_statistic(t_statistic, tail):
+    """Turns t-statistics into the statistic whose large values count as extreme for the given tail."""
+    if tail == 'greater':
+        return t_statistic
+    if tail == 'less':
+        return -t_statistic
+    return np.abs(t_statistic)
+
+
+def _permutation_block(differences, sum_squares, n, observed, seed, num_permutations, chunk_size, tail):
+    """
+    Runs one block of sign-flip permutations, drawn chunk by chunk to cap memory.
+    Returns how many permutations reach the observed statistic for every test, and the maximum statistic
+    over all tests for every permutation.
+    """
+    rng = np.random.default_rng(seed)
+    num_subjects = differences.shape[0]
+    exceed = np.zeros(differences.shape[1], dtype=np.int64)
+    max_statistics = np.empty(num_permutations)
+
+    for start in range(0, num_permutations, chunk_size):
+        size = min(chunk_size, num_permutations - start)
+        sign_flips = rng.integers(0, 2, size=(size, num_subjects)) * 2.0 - 1.0
+        statistics = _tail_statistic(paired_t_statistics(sign_flips, differences, sum_squares, n), tail)
+        statistics = np.nan_to_num(statistics, nan=-np.inf)
+        exceed += (statistics >= observed).sum(axis=0)
+        max_statistics[start:start + size] = statistics.max(axis=1)
+
+    return exceed, max_statistics
+
+
+def sign_flip_test(differences, num_permutations=10000, chunk_size=1000, workers=1, seed=None,
+                   tail='two-sided'):
+    """
+    Paired sign-flip permutation test of the mean difference for several tests sharing the same subjects.
+    `differences` is (subjects x tests), NaN where a subject has no pair for a test. The same sign flip is
+    applied to a subject in every test, so the max-statistic family-wise correction keeps the dependence
+    between tests.
+    The permutations are split into blocks of `chunk_size` with their own random streams, so the result
+    only depends on `seed`, whatever the number of workers the blocks are spread across.
+    Returns a dictionary with the observed t-statistics, the uncorrected p-values, and the max-statistic
+    family-wise corrected p-values.
+    """
+    differences = np.asarray(differences, dtype=float)
+    if differences.ndim == 1:
+        differences = differences[:, np.newaxis]
+
+    paired = ~np.isnan(differences)
+    n = paired.sum(axis=0)
+    differences = np.where(paired, differences, 0.0)
+    sum_squares = (differences ** 2).sum(axis=0)
+
+    t_statistic = paired_t_statistics(np.ones((1, differences.shape[0])), differences, sum_squares, n)[0]
+    t_statistic[n < 2] = np.nan
+    observed = _tail_statistic(t_statistic, tail)
+
+    # Independent random streams for every block of permutations
+    block_sizes = [min(chunk_size, num_permutations - start) for start in range(0, num_permutations, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+    blocks = [(differences, sum_squares, n, observed, block_seed, size, chunk_size, tail)
+              for block_seed, size in zip(seeds, block_sizes)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_permutation_block, *zip(*blocks)))
+    else:
+        results = [_permutation_block(*block) for block in blocks]
+
+    exceed = sum(result[0] for result in results)
+    max_statistics = np.concatenate([result[1] for result in results])
+
+    # The observed labelling counts as one of the permutations
+    p_value = (exceed + 1) / (num_permutations + 1)
+    max_statistics.sort()
+    max_exceed = max_statistics.size - np.searchsorted(max_statistics, observed, side='left')
+    p_fwer = (max_exceed + 1) / (num_permutations + 1)
+    p_value[np.isnan(observed)] = np.nan
+    p_fwer[np.isnan(observed)] = np.nan
+
+    return {
+        't_statistic': t_statistic,
+        'p_value': p_value,
+        'p_fwer': p_fwer,
+    }
@@ -0,0 +1,205 @@
+import os
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import GraphBuild
+from FigureRenderer import render_figures
+from GraphBuild import Wavelength
+from GraphMetrics import GraphMetrics, _calculate_chunk, _init_worker
+from Instrumentation import measure
+from PipelineManifest import (PipelineManifest, build_and_hash_graphs, discover_inputs, load_pickle,
+                              remove_missing_inputs, sorted_metadata)
+from SignificanceTester import SignificanceTester
+
+
+class Pipeline:
+    def __init__(self, csv_address_base, graphml_directory='saved_graphml_files',
+                 checkpoint_directory='pipeline_checkpoints', manifest_file='pipeline_manifest.json',
+                 metadata_file='graph_metadata.pkl', metrics_file='graph_metrics.pkl',
+                 table_directory='graph_metrics_table', stats_file='significance_results.csv',
+                 figure_directory='figures', build_workers=2, metrics_workers=None, plot_workers=2,
+                 graph_metrics_options=None, state_1='rest', state_2='film', profiler=None):
+        """
+        Runs build -> metrics -> stats -> plots as a DAG of tasks: one build task per (subject, state) CSV,
+        one metrics task per (subject, state, wavelength) graph, then the statistics and the figures.
+        A graph's metrics task is submitted as soon as the build of its CSV finishes, so the builds and the
+        metrics overlap. Every stage has its own bounded process pool (`build_workers`, `metrics_workers`,
+        `plot_workers`).
+        Every finished task is checkpointed: the manifest is saved after each build, and the metrics of
+        each graph are saved in `checkpoint_directory`. An interrupted run resumes where it stopped, and a
+        new run only redoes the tasks whose inputs changed (see PipelineManifest).
+        An optional Profiler (see Instrumentation) measures every stage, and every graph and metric of the
+        metrics tasks.
+        """
+        self.csv_address_base = csv_address_base
+        self.graphml_directory = graphml_directory
+        self.checkpoint_directory = checkpoint_directory
+        self.manifest = PipelineManifest(manifest_file)
+        self.metadata_file = metadata_file
+        self.metrics_file = metrics_file
+        self.table_directory = table_directory
+        self.stats_file = stats_file
+        self.figure_directory = figure_directory
+        self.build_workers = build_workers
+        self.metrics_workers = metrics_workers or os.cpu_count()
+        self.plot_workers = plot_workers
+        self.graph_metrics_options = graph_metrics_options or {}
+        self.state_1 = state_1
+        self.state_2 = state_2
+        self.profiler = profiler
+        self.signature = None  # Metrics signature of the GraphMetrics of the current run
+
+    def checkpoint_file(self, key):
+        """
+        Returns the checkpoint file holding the metrics of a (subject, state, wavelength) graph.
+        """
+        subject, state, wavelength = key
+        return os.path.join(self.checkpoint_directory, f"metrics_{subject}_{state}_{wavelength.name}.pkl")
+
+    def load_checkpoint(self, key):
+        """
+        Returns the checkpoint of a graph if it was saved with the metrics signature of this run, else None.
+        """
+        checkpoint = load_pickle(self.checkpoint_file(key))
+        if checkpoint.get('signature') != self.signature:
+            return None
+        return checkpoint
+
+    def metrics_ready(self, key):
+        """
+        Tells whether the checkpointed metrics of a graph are up to date with its current content and with
+        the metric options and registry of this run (its metrics signature).
+        """
+        subject, state, wavelength = key
+        return (not self.manifest.metrics_outdated(subject, state, wavelength.name, self.signature) and
+                self.load_checkpoint(key) is not None)
+
+    def save_checkpoint(self, key, metrics, partition_entry):
+        """
+        Saves the metrics of a graph atomically with the metrics signature, then records them in the manifest.
+        """
+        filename = self.checkpoint_file(key)
+        with open(f"{filename}.tmp", 'wb') as file:
+            pickle.dump({'metrics': metrics, 'partition': partition_entry, 'signature': self.signature}, file)
+        os.replace(f"{filename}.tmp", filename)
+        subject, state, wavelength = key
+        self.manifest.record_metrics(subject, state, wavelength.name, self.signature)
+        self.manifest.save()
+
+    def run(self):
+        """
+        Runs the pipeline and returns a summary with the built pairs, the measured graphs, the removed pairs
+        and whether the statistics and figures were refreshed.
+        """
+        os.makedirs(self.graphml_directory, exist_ok=True)
+        os.makedirs(self.checkpoint_directory, exist_ok=True)
+        inputs = discover_inputs(self.csv_address_base)
+        metadata = load_pickle(self.metadata_file)
+        removed = remove_missing_inputs(self.manifest, inputs, metadata)
+        metadata = {key: graph_file for key, graph_file in metadata.items() if key[:2] in inputs}
+        GraphBuild.save_metadata(metadata, self.metadata_file)
+
+        # The metrics workers get their GraphMetrics instance once, when they start
+        graph_metrics = GraphMetrics(self.metadata_file, profiler=self.profiler, **self.graph_metrics_options)
+        self.signature = graph_metrics.metrics_signature()
+        built, measured = [], []
+
+        with measure(self.profiler, 'build_and_metrics'), \
+                ProcessPoolExecutor(max_workers=self.build_workers) as build_pool, \
+                ProcessPoolExecutor(max_workers=self.metrics_workers, initializer=_init_worker,
+                                    initargs=(graph_metrics,)) as metrics_pool:
+            pending = {}
+
+            def submit_metrics(key):
+                future = metrics_pool.submit(_calculate_chunk, [(key, metadata[key])])
+                pending[future] = ('metrics', key)
+
+            # Build the new or changed inputs, and measure the graphs that are built already
+            for (subject, state), csv_file in inputs.items():
+                if (self.manifest.input_changed(subject, state, csv_file) or
+                        self.manifest.graph_outdated(subject, state)):
+                    future = build_pool.submit(build_and_hash_graphs, subject, state, self.csv_address_base,
+                                               self.graphml_directory)
+                    pending[future] = ('build', (subject, state))
+                else:
+                    for wavelength in Wavelength:
+                        key = (subject, state, wavelength)
+                        if key in metadata and not self.metrics_ready(key):
+                            submit_metrics(key)
+
+            # Every finished task releases the tasks that depend on it
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, item = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Failed to {stage} {item}: {e}")
+                        continue
+
+                    if stage == 'build':
+                        subject, state = item
+                        for wavelength_name, graph_file, digest in result:
+                            key = (subject, state, Wavelength[wavelength_name])
+                            metadata[key] = graph_file
+                            self.manifest.record_graph(subject, state, wavelength_name, graph_file, digest)
+                            if not self.metrics_ready(key):
+                                submit_metrics(key)
+                        self.manifest.record_input(subject, state, inputs[item])
+                        self.manifest.save()
+                        built.append(item)
+                    else:
+                        results, records = result
+                        if self.profiler is not None:
+                            self.profiler.merge(records)
+                        metrics, partition_entry = results[0]
+                        self.save_checkpoint(item, metrics, partition_entry)
+                        measured.append(item)
+
+        metadata = sorted_metadata(metadata)
+        GraphBuild.save_metadata(metadata, self.metadata_file)
+
+        # Gather the metrics of every graph from the checkpoints of this signature
+        changed = bool(measured or removed) or not os.path.exists(self.metrics_file)
+        if changed:
+            all_metrics = {}
+            for key in metadata:
+                checkpoint = self.load_checkpoint(key)
+                if checkpoint is not None:
+                    all_metrics[key] = checkpoint['metrics']
+                    if checkpoint['partition'] is not None:
+                        graph_metrics.partitions[graph_metrics.partition_key(key)] = checkpoint['partition']
+            graph_metrics.metadata = metadata
+            graph_metrics.iterate_and_calculate_metrics(output_file=self.metrics_file,
+                                                        table_directory=self.table_directory, keys=[],
+                                                        existing_metrics=all_metrics)
+
+        # Stats and plots need every metric, so they run last
+        metrics_source = self.table_directory if self.table_directory is not None else self.metrics_file
+        stats_refreshed = changed or not os.path.exists(self.stats_file)
+        if stats_refreshed:
+            with measure(self.profiler, 'stats'):
+                tester = SignificanceTester(metrics_source)
+                tester.compare_global_metrics_batch(self.state_1, self.state_2).to_csv(self.stats_file, index=False)
+
+        # Figures whose inputs did not change are skipped by the renderer
+        figures_refreshed = False
+        if self.figure_directory is not None:
+            with measure(self.profiler, 'figures'):
+                rendered = render_figures(metrics_source, self.figure_directory, workers=self.plot_workers)
+            figures_refreshed = bool(rendered['rendered'])
+
+        return {
+            'built': built,
+            'measured': measured,
+            'removed': removed,
+            'stats_refreshed': stats_refreshed,
+            'figures_refreshed': figures_refreshed,
+        }
+
+
+if __name__ == "__main__":
+    pipeline = Pipeline(GraphBuild.csv_address_base, GraphBuild.graphml_directory)
+    summary = pipeline.run()
+    print(f"Built {len(summary['built'])} subject/state pairs, measured {len(summary['measured'])} graphs, "
+          f"removed {len(summary['removed'])} pairs")
@@ -0,0 +1,258 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import re
+import networkx as nx
+import GraphBuild
+from GraphBuild import Wavelength, save_subject_state_graphs
+from GraphMetrics import GraphMetrics
+from MetricCache import graph_hash
+from SignificanceTester import SignificanceTester
+
+
+def file_sha256(filename, block_size=1024 ** 2):
+    """
+    Calculates the SHA-256 of a file, reading it block by block.
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover_inputs(csv_address_base):
+    """
+    Finds the coherence CSVs next to `csv_address_base` ({base}{subject}_{state}_coherence.csv), so new
+    recordings are picked up without editing the subject list.
+    Returns a dictionary mapping every (subject, state) to its CSV file.
+    """
+    pattern = re.compile(re.escape(os.path.basename(csv_address_base)) + r'(.+)_([^_]+)_coherence\.csv$')
+    inputs = {}
+    for csv_file in sorted(glob.glob(f"{glob.escape(csv_address_base)}*_coherence.csv")):
+        match = pattern.match(os.path.basename(csv_file))
+        if match:
+            inputs[match.groups()] = csv_file
+    return inputs
+
+
+def _entry_key(*parts):
+    """Joins the parts of a (subject, state[, wavelength name]) key into a manifest key."""
+    return '|'.join(parts)
+
+
+class PipelineManifest:
+    def __init__(self, filename='pipeline_manifest.json'):
+        """
+        Loads the pipeline manifest, or starts an empty one.
+        The manifest records the fingerprint (mtime, size, SHA-256) of every input CSV, the graph file and
+        graph hash built for every (subject, state, wavelength), and the graph hash and metrics signature
+        (see GraphMetrics.metrics_signature) the metrics of every graph were calculated for, so that only
+        new or changed items have to be rebuilt or re-measured.
+        """
+        self.filename = filename
+        self.inputs = {}
+        self.graphs = {}
+        self.metrics = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as file:
+                manifest = json.load(file)
+            self.inputs = manifest.get('inputs', {})
+            self.graphs = manifest.get('graphs', {})
+            self.metrics = manifest.get('metrics', {})
+
+    def save(self):
+        """
+        Writes the manifest atomically, so an interrupted run never leaves a half-written manifest.
+        """
+        temporary = f"{self.filename}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump({'inputs': self.inputs, 'graphs': self.graphs, 'metrics': self.metrics}, file, indent=2)
+        os.replace(temporary, self.filename)
+
+    def input_changed(self, subject, state, csv_file):
+        """
+        Tells whether the CSV of a subject and state is new or changed since it was recorded.
+        The file is only hashed when its mtime or size changed, and a file that was touched without
+        changing its content does not count as changed.
+        """
+        recorded = self.inputs.get(_entry_key(subject, state))
+        if recorded is None or recorded['path'] != csv_file:
+            return True
+        stat = os.stat(csv_file)
+        if recorded['mtime'] == stat.st_mtime and recorded['size'] == stat.st_size:
+            return False
+        return recorded['sha256'] != file_sha256(csv_file)
+
+    def record_input(self, subject, state, csv_file):
+        """
+        Records the fingerprint of the CSV of a subject and state.
+        """
+        stat = os.stat(csv_file)
+        self.inputs[_entry_key(subject, state)] = {
+            'path': csv_file,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha256': file_sha256(csv_file),
+        }
+
+    def graph_outdated(self, subject, state):
+        """
+        Tells whether any graph of a subject and state is missing from the manifest or from the disk.
+        """
+        for wavelength in Wavelength:
+            entry = self.graphs.get(_entry_key(subject, state, wavelength.name))
+            if entry is None or not os.path.exists(entry['file']):
+                return True
+        return False
+
+    def record_graph(self, subject, state, wavelength_name, graph_file, digest):
+        """
+        Records the graph file built for a (subject, state, wavelength) and the hash of its content.
+        """
+        self.graphs[_entry_key(subject, state, wavelength_name)] = {'file': graph_file, 'graph_hash': digest}
+
+    def metrics_outdated(self, subject, state, wavelength_name, signature):
+        """
+        Tells whether the metrics of a graph were never calculated, or were calculated for another graph or
+        with other metric options or another metric registry (another signature).
+        """
+        key = _entry_key(subject, state, wavelength_name)
+        return key not in self.graphs or self.metrics.get(key) != {'graph_hash': self.graphs[key]['graph_hash'],
+                                                                   'signature': signature}
+
+    def record_metrics(self, subject, state, wavelength_name, signature):
+        """
+        Records that the metrics of a graph are up to date with its current content and metrics signature.
+        """
+        key = _entry_key(subject, state, wavelength_name)
+        if key in self.graphs:
+            self.metrics[key] = {'graph_hash': self.graphs[key]['graph_hash'], 'signature': signature}
+
+    def forget(self, subject, state):
+        """
+        Removes a subject and state whose CSV disappeared.
+        """
+        self.inputs.pop(_entry_key(subject, state), None)
+        for wavelength in Wavelength:
+            self.graphs.pop(_entry_key(subject, state, wavelength.name), None)
+            self.metrics.pop(_entry_key(subject, state, wavelength.name), None)
+
+
+def load_pickle(filename):
+    """Loads a Pickle file, or returns an empty dictionary if it does not exist."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+def remove_missing_inputs(manifest, inputs, metadata):
+    """
+    Drops the subject/state pairs whose CSV disappeared from the manifest and the metadata map.
+    Returns the removed pairs.
+    """
+    removed = sorted({tuple(key.split('|')) for key in manifest.inputs} - set(inputs))
+    for subject, state in removed:
+        manifest.forget(subject, state)
+        for wavelength in Wavelength:
+            metadata.pop((subject, state, wavelength), None)
+    return removed
+
+
+def build_and_hash_graphs(subject, state, csv_address_base, graphml_directory):
+    """
+    Builds and saves the GraphML files of a subject and state.
+    Returns a list of (wavelength name, GraphML filename, graph hash) triples, the hash being taken from
+    the saved file as the metrics will read it.
+    """
+    saved = save_subject_state_graphs(subject, state, csv_address_base, graphml_directory)
+    return [(wavelength_name, graph_file, graph_hash(nx.read_graphml(graph_file)))
+            for wavelength_name, graph_file in saved]
+
+
+def sorted_metadata(metadata):
+    """Orders a metadata map by subject, state and wavelength."""
+    return {key: metadata[key] for key in sorted(metadata, key=lambda key: (key[0], key[1], key[2].value))}
+
+
+def update_pipeline(csv_address_base, graphml_directory='saved_graphml_files',
+                    manifest_file='pipeline_manifest.json', metadata_file='graph_metadata.pkl',
+                    metrics_file='graph_metrics.pkl', table_directory='graph_metrics_table',
+                    stats_file='significance_results.csv', state_1='rest', state_2='film', workers=1,
+                    graph_metrics_options=None):
+    """
+    Brings the graphs, metrics and statistics up to date with the CSVs found next to `csv_address_base`.
+    - Graphs are only rebuilt for the (subject, state) pairs whose CSV is new or changed, or whose GraphML
+      files are missing. Graphs of CSVs that disappeared are dropped.
+    - Metrics are only calculated for the (subject, state, wavelength) graphs whose content hash changed,
+      and merged into the existing metrics file and metrics table. Changing `graph_metrics_options` or the
+      metric registry changes the metrics signature, and every graph is measured again.
+    - The batch significance tests are refreshed from the metrics table when any metric changed.
+    `graph_metrics_options` are passed on to GraphMetrics (for example a MetricCache).
+    Returns a summary with the rebuilt pairs, the re-measured keys, the removed pairs and whether the
+    statistics were refreshed.
+    """
+    manifest = PipelineManifest(manifest_file)
+    inputs = discover_inputs(csv_address_base)
+    os.makedirs(graphml_directory, exist_ok=True)
+    metadata = load_pickle(metadata_file)
+
+    # Drop what belongs to CSVs that are gone
+    removed = remove_missing_inputs(manifest, inputs, metadata)
+
+    # Rebuild the graphs of new or changed inputs
+    rebuilt = []
+    for (subject, state), csv_file in inputs.items():
+        if not manifest.input_changed(subject, state, csv_file) and not manifest.graph_outdated(subject, state):
+            continue
+        try:
+            saved = build_and_hash_graphs(subject, state, csv_address_base, graphml_directory)
+        except Exception as e:
+            print(f"Failed to build graphs for Subject: {subject}, State: {state}: {e}")
+            continue
+        for wavelength_name, graph_file, digest in saved:
+            metadata[(subject, state, Wavelength[wavelength_name])] = graph_file
+            manifest.record_graph(subject, state, wavelength_name, graph_file, digest)
+        manifest.record_input(subject, state, csv_file)
+        rebuilt.append((subject, state))
+
+    metadata = sorted_metadata(metadata)
+    GraphBuild.save_metadata(metadata, metadata_file)
+
+    # Re-measure only the graphs whose content changed
+    existing_metrics = load_pickle(metrics_file)
+    graph_metrics = GraphMetrics(metadata_file, **(graph_metrics_options or {}))
+    signature = graph_metrics.metrics_signature()
+    measured = [key for key in metadata if key not in existing_metrics or
+                manifest.metrics_outdated(key[0], key[1], key[2].name, signature)]
+    changed = bool(measured or removed) or not os.path.exists(metrics_file)
+    if changed:
+        graph_metrics.iterate_and_calculate_metrics(workers, output_file=metrics_file,
+                                                    table_directory=table_directory, keys=measured,
+                                                    existing_metrics=existing_metrics)
+        for subject, state, wavelength in measured:
+            manifest.record_metrics(subject, state, wavelength.name, signature)
+    manifest.save()
+
+    # Refresh the statistics from the metrics table
+    refreshed = changed or not os.path.exists(stats_file)
+    if refreshed:
+        tester = SignificanceTester(table_directory if table_directory is not None else metrics_file)
+        tester.compare_global_metrics_batch(state_1, state_2).to_csv(stats_file, index=False)
+
+    return {
+        'rebuilt': rebuilt,
+        'measured': measured,
+        'removed': removed,
+        'stats_refreshed': refreshed,
+    }
+
+
+if __name__ == "__main__":
+    summary = update_pipeline(GraphBuild.csv_address_base, GraphBuild.graphml_directory,
+                              workers=GraphBuild.workers)
+    print(f"Rebuilt {len(summary['rebuilt'])} subject/state pairs, re-measured {len(summary['measured'])} graphs, "
+          f"removed {len(summary['removed'])} pairs")
@@ -1,15 +1,16 @@
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from FigureRenderer import finish_figure, prepare_axes
 
 class PlotResults:
     def __init__(self, global_results, node_results):
         self.global_results = global_results
         self.node_results = node_results
 
-    def plot_global_metric(self, metric_name):
+    def plot_global_metric(self, metric_name, save_path=None, fig=None):
         """
         Plots a bar graph showing the mean of a global metric for each subject across rest and film conditions.
+        With a save path the figure is written to disk instead of shown, and a figure passed in is reused.
         """
         rest_means = []
         film_means = []
@@ -28,7 +29,8 @@ class PlotResults:
         x = np.arange(len(subjects))  # Number of subjects
         width = 0.35  # Width of the bars
 
-        fig, ax = plt.subplots()
+        reused = fig is not None
+        fig, ax = prepare_axes(fig, (6.4, 4.8))
         ax.bar(x - width/2, rest_means, width, label='Rest')
         ax.bar(x + width/2, film_means, width, label='Film')
 
@@ -40,7 +42,7 @@ class PlotResults:
         ax.set_xticklabels(subjects)
         ax.legend()
 
-        plt.show()
+        finish_figure(fig, save_path, reused)
 
 # Example usage
 if __name__ == "__main__":
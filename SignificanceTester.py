@@ -1,14 +1,59 @@
 from scipy import stats
 import numpy as np
+import os
+import pandas as pd
 import pickle
+from Instrumentation import measure
+from MetricsTable import MetricsTable
+from PermutationTest import sign_flip_test
 from shared import Wavelength
 
+
+def bonferroni_correction(p_values):
+    """
+    Bonferroni-corrected p-values. NaN p-values are ignored and do not count as tests.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    num_tests = np.count_nonzero(~np.isnan(p_values))
+    return np.minimum(p_values * num_tests, 1.0)
+
+
+def fdr_correction(p_values):
+    """
+    Benjamini-Hochberg (FDR) adjusted p-values. NaN p-values are ignored and do not count as tests.
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    tested = np.flatnonzero(~np.isnan(p_values))
+    if tested.size == 0:
+        return adjusted
+
+    order = tested[np.argsort(p_values[tested])]
+    ranked = p_values[order] * tested.size / np.arange(1, tested.size + 1)
+    # Enforce monotonicity from the largest p-value down
+    adjusted[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return adjusted
+
+
 class SignificanceTester:
-    def __init__(self, metrics_file):
+    def __init__(self, metrics_file, profiler=None):
         """
         Initializes the SignificanceTester by loading the metrics file.
+        The metrics file is either graph_metrics.pkl or a saved MetricsTable directory.
+        An optional Profiler (see Instrumentation) measures every paired t-test and K-S test.
         """
-        self.metrics = self.load_metrics(metrics_file)
+        self.profiler = profiler
+        if os.path.isdir(metrics_file):
+            self.metrics = None
+            self.table = MetricsTable.load(metrics_file)
+        else:
+            self.metrics = self.load_metrics(metrics_file)
+            self.table = MetricsTable.from_metrics(self.metrics)
+
+        # Subject-aligned global metric tensors, built once per state by build_global_index
+        self.global_metric_names = self.table.metric_names('global')
+        self.wavelengths = list(Wavelength)
+        self.global_index = {}
 
     def load_metrics(self, filename):
         """
@@ -21,31 +66,57 @@ class SignificanceTester:
         """
         Extracts the global metric values for a given state and wavelength.
         """
-        metric_values = []
-        for (subject, task_state, task_wavelength), metrics in self.metrics.items():
-            if (state is None or task_state == state) and (wavelength is None or task_wavelength == wavelength):
-                metric_values.append(metrics['global_metrics'][metric_name])
-        return np.array(metric_values)
+        return self.table.query_global(metric_name, state, wavelength)['value']
 
     def extract_node_based_metric(self, metric_name, state=None, wavelength=None):
         """
         Extracts node-based metric values for a given state and wavelength.
         Returns all node-level values (not aggregated) for each graph.
         """
-        metric_values = []
-        for (subject, task_state, task_wavelength), metrics in self.metrics.items():
-            if (state is None or task_state == state) and (wavelength is None or task_wavelength == wavelength):
-                # Assuming node-based metric values are stored in a dictionary under 'node_metrics'
-                metric_values.extend(metrics['node_metrics'][metric_name].values())  # Get all node-level values
-        return np.array(metric_values)
+        return self.table.query_node(metric_name, state, wavelength)['value']
+
+    def build_global_index(self, state):
+        """
+        Builds the (subjects x wavelengths x global metrics) tensor of a state, once.
+        The subject axis follows self.table.subjects for every state, and missing values are NaN.
+        """
+        if state not in self.global_index:
+            tensor = np.full((len(self.table.subjects), len(self.wavelengths), len(self.global_metric_names)),
+                             np.nan)
+
+            # Lookup from wavelength value to its position on the wavelength axis
+            positions = np.full(max(w.value for w in self.wavelengths) + 1, -1)
+            positions[[w.value for w in self.wavelengths]] = np.arange(len(self.wavelengths))
+
+            for m, metric_name in enumerate(self.global_metric_names):
+                rows = self.table.query_global(metric_name, state)
+                tensor[rows['subject'], positions[rows['wavelength']], m] = rows['value']
+            self.global_index[state] = tensor
+        return self.global_index[state]
+
+    def extract_paired_global_metric(self, metric_name, state_1, state_2, wavelength):
+        """
+        Extracts the global metric values of two states for a specific wavelength, paired by subject.
+        Only the subjects that have a value in both states are kept.
+        Returns the subject IDs and the values of each state.
+        """
+        w = self.wavelengths.index(Wavelength[wavelength.name])
+        m = self.global_metric_names.index(metric_name)
+        values_state_1 = self.build_global_index(state_1)[:, w, m]
+        values_state_2 = self.build_global_index(state_2)[:, w, m]
+
+        paired = ~np.isnan(values_state_1) & ~np.isnan(values_state_2)
+        subjects = np.array(self.table.subjects, dtype=object)[paired]
+        return subjects, values_state_1[paired], values_state_2[paired]
 
     def perform_paired_t_test(self, metric_name, state_1, state_2, wavelength, alpha=0.05):
         """
         Performs a paired t-test on global metrics between two states for a specific wavelength.
         Returns the t-statistic, p-value, and whether the result is significant.
         """
-        values_state_1 = self.extract_global_metric(metric_name, state_1, wavelength)
-        values_state_2 = self.extract_global_metric(metric_name, state_2, wavelength)
+        # The values are paired by subject ID through the subject-aligned index
+        _, values_state_1, values_state_2 = self.extract_paired_global_metric(metric_name, state_1, state_2,
+                                                                              wavelength)
 
         # Perform the paired t-test
         t_statistic, p_value = stats.ttest_rel(values_state_1, values_state_2)
@@ -79,6 +150,65 @@ class SignificanceTester:
             'significant': is_significant
         }
 
+    def compare_global_metrics_batch(self, state_1, state_2, alpha=0.05, correction='fdr'):
+        """
+        Compares all global metrics between two states with paired t-tests for every wavelength and metric
+        at once, vectorized along the subject axis of the global index. Nothing is printed.
+        Returns a DataFrame with one row per (wavelength, metric), holding the t-statistic, the raw p-value,
+        the FDR (Benjamini-Hochberg) and Bonferroni corrected p-values, and whether the result is
+        significant after the chosen correction ('fdr', 'bonferroni' or None).
+        """
+        differences = self.build_global_index(state_1) - self.build_global_index(state_2)
+
+        # Paired t-test on the subjects that have a value in both states
+        paired = ~np.isnan(differences)
+        n = paired.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(paired, differences, 0.0).sum(axis=0) / n
+            variance = np.where(paired, differences - mean, 0.0) ** 2
+            std = np.sqrt(variance.sum(axis=0) / (n - 1))
+            t_statistic = mean / (std / np.sqrt(n))
+        t_statistic[n < 2] = np.nan
+        p_value = 2 * stats.t.sf(np.abs(t_statistic), n - 1)
+
+        results = pd.DataFrame({
+            'Wavelength': np.repeat([w.name for w in self.wavelengths], len(self.global_metric_names)),
+            'Metric': np.tile(self.global_metric_names, len(self.wavelengths)),
+            'N': n.ravel(),
+            't_statistic': t_statistic.ravel(),
+            'p_value': p_value.ravel(),
+        })
+        results['p_fdr'] = fdr_correction(results['p_value'])
+        results['p_bonferroni'] = bonferroni_correction(results['p_value'])
+
+        corrected = {'fdr': 'p_fdr', 'bonferroni': 'p_bonferroni', None: 'p_value'}[correction]
+        results['significant'] = results[corrected] < alpha
+        return results
+
+    def compare_global_metrics_permutation(self, state_1, state_2, num_permutations=10000, chunk_size=1000,
+                                           workers=1, seed=None, alpha=0.05, tail='two-sided'):
+        """
+        Compares all global metrics between two states with sign-flip permutation tests for every wavelength
+        and metric at once. Nothing is printed.
+        Returns a DataFrame with one row per (wavelength, metric), holding the t-statistic, the uncorrected
+        permutation p-value and the max-statistic family-wise corrected p-value across wavelengths and metrics.
+        """
+        differences = self.build_global_index(state_1) - self.build_global_index(state_2)
+        num_subjects = differences.shape[0]
+        result = sign_flip_test(differences.reshape(num_subjects, -1), num_permutations, chunk_size, workers,
+                                seed, tail)
+
+        results = pd.DataFrame({
+            'Wavelength': np.repeat([w.name for w in self.wavelengths], len(self.global_metric_names)),
+            'Metric': np.tile(self.global_metric_names, len(self.wavelengths)),
+            'N': (~np.isnan(differences)).sum(axis=0).ravel(),
+            't_statistic': result['t_statistic'],
+            'p_value': result['p_value'],
+            'p_fwer': result['p_fwer'],
+        })
+        results['significant'] = results['p_fwer'] < alpha
+        return results
+
     def compare_global_metrics(self, state_1, state_2, alpha=0.05):
         """
         Compares all global metrics between two states using a paired t-test.
@@ -90,8 +220,9 @@ class SignificanceTester:
             results[wavelength] = {}
 
             # Loop through all global metrics (e.g., num_nodes, modularity)
-            for metric_name in next(iter(self.metrics.values()))['global_metrics'].keys():
-                result = self.perform_paired_t_test(metric_name, state_1, state_2, wavelength, alpha)
+            for metric_name in self.global_metric_names:
+                with measure(self.profiler, 't_test', (None, None, wavelength), metric_name):
+                    result = self.perform_paired_t_test(metric_name, state_1, state_2, wavelength, alpha)
                 results[wavelength][metric_name] = result
 
                 print(f"  Global Metric: {metric_name}")
@@ -115,8 +246,9 @@ class SignificanceTester:
             results[wavelength] = {}
 
             # Loop through all node-based metrics (e.g., degree_centrality, clustering_coefficient)
-            for metric_name in next(iter(self.metrics.values()))['node_metrics'].keys():
-                result = self.perform_ks_test(metric_name, state_1, state_2, wavelength, alpha)
+            for metric_name in self.table.metric_names('node'):
+                with measure(self.profiler, 'ks_test', (None, None, wavelength), metric_name):
+                    result = self.perform_ks_test(metric_name, state_1, state_2, wavelength, alpha)
                 results[wavelength][metric_name] = result
 
                 print(f"  Node-Based Metric: {metric_name}")
@@ -140,3 +272,8 @@ if __name__ == "__main__":
     # Compare node-level metrics using K-S test
     print("\nComparing Node-Level Metrics (K-S Test):")
     node_results = significance_tester.compare_node_metrics(state_1='rest', state_2='film', alpha=0.05)
+
+    # Compare every wavelength and global metric in one vectorized batch, with corrected p-values
+    print("\nBatch Comparison of Global Metrics (Paired T-Test, FDR/Bonferroni corrected):")
+    batch_results = significance_tester.compare_global_metrics_batch(state_1='rest', state_2='film', alpha=0.05)
+    print(batch_results.to_string(index=False))
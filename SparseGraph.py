@@ -0,0 +1,114 @@
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+
+class SparseGraph:
+    """
+    Lightweight weighted undirected graph held in CSR arrays, for thresholded (sparse) graphs.
+    `nodes` holds the node IDs (electrodes) in the order of the matrix rows, and the neighbours of the
+    node at position i are indices[indptr[i]:indptr[i + 1]], with their edge weights in `weights`.
+    Every edge is stored in both directions, like a symmetric adjacency matrix.
+    A graph of 64 electrodes with 10% of its edges takes a few kilobytes, against hundreds of bytes per
+    edge for an nx.Graph, so a whole cohort fits in a few megabytes.
+    It exposes the parts of the nx.Graph interface the metrics use (nodes, edges, number_of_nodes,
+    number_of_edges), and converts to NetworkX for the metrics that still need it.
+    """
+    __slots__ = ('nodes', 'indptr', 'indices', 'weights')
+
+    def __init__(self, nodes, indptr, indices, weights):
+        self.nodes = tuple(nodes)
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=float)
+
+    @classmethod
+    def from_adjacency(cls, nodes, adjacency):
+        """
+        Builds a graph from its node IDs and a symmetric (scipy sparse or dense) adjacency matrix.
+        """
+        adjacency = sparse.csr_matrix(adjacency, dtype=float)
+        adjacency.eliminate_zeros()
+        adjacency.sort_indices()
+        return cls(nodes, adjacency.indptr, adjacency.indices, adjacency.data)
+
+    @classmethod
+    def from_edges(cls, rows, cols, weights):
+        """
+        Builds a graph from thresholded edge arrays with 0-based electrode indices, like
+        EdgeThreshold.edges_to_graph: nodes are numbered from 1 like the electrodes, only the electrodes
+        with at least one edge are kept, in the order they first appear in the edges.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        endpoints = np.column_stack((rows, cols)).ravel()
+        electrodes, first = np.unique(endpoints, return_index=True)
+        electrodes = electrodes[np.argsort(first, kind='stable')]
+
+        # Position of every electrode in the node order
+        positions = np.empty(electrodes.max() + 1 if electrodes.size else 0, dtype=np.int64)
+        positions[electrodes] = np.arange(electrodes.size)
+        u, v = positions[rows], positions[cols]
+        weights = np.asarray(weights, dtype=float)
+        adjacency = sparse.csr_matrix((np.concatenate((weights, weights)), (np.concatenate((u, v)),
+                                                                             np.concatenate((v, u)))),
+                                      shape=(electrodes.size, electrodes.size))
+        return cls.from_adjacency((electrodes + 1).tolist(), adjacency)
+
+    @classmethod
+    def from_networkx(cls, graph, weight='weight'):
+        """
+        Converts an nx.Graph, keeping its node IDs and node order. Edges without a weight get 1.
+        """
+        nodes = list(graph.nodes)
+        return cls.from_adjacency(nodes, nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=weight,
+                                                                  format='csr'))
+
+    def to_networkx(self):
+        """
+        Converts the graph to an nx.Graph with the same node IDs, node order and weighted edges.
+        """
+        G = nx.Graph()
+        G.add_nodes_from(self.nodes)
+        G.add_weighted_edges_from(self.edges(data='weight'))
+        return G
+
+    def to_adjacency(self):
+        """
+        Returns the weighted adjacency matrix as a CSR matrix sharing the arrays of the graph.
+        """
+        num_nodes = len(self.nodes)
+        return sparse.csr_matrix((self.weights, self.indices, self.indptr), shape=(num_nodes, num_nodes),
+                                 copy=False)
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return self.indices.size // 2
+
+    def edges(self, data=None):
+        """
+        Yields every edge once as (u, v) node IDs, or (u, v, weight) when `data` is given, like
+        nx.Graph.edges(data='weight').
+        """
+        rows = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        upper = rows < self.indices
+        for i, j, weight in zip(rows[upper].tolist(), self.indices[upper].tolist(), self.weights[upper].tolist()):
+            if data is None:
+                yield self.nodes[i], self.nodes[j]
+            else:
+                yield self.nodes[i], self.nodes[j], weight
+
+    @property
+    def nbytes(self):
+        """
+        Memory taken by the arrays of the graph.
+        """
+        return self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __repr__(self):
+        return f"SparseGraph({self.number_of_nodes()} nodes, {self.number_of_edges()} edges)"
@@ -0,0 +1,123 @@
+import numpy as np
+from CoherenceLoader import START, STOP, iter_band_matrices
+
+
+class RunningStats:
+    def __init__(self):
+        """
+        Running count, mean, variance, minimum and maximum of a stream of values, in constant memory.
+        Batches are combined with the parallel form of Welford's algorithm (Chan et al.), so statistics of
+        separate streams can also be merged.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        """Combines the statistics of another batch of values into these."""
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def update(self, values):
+        """
+        Adds a batch of values. NaN values are ignored.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size:
+            mean = values.mean()
+            self._combine(values.size, mean, ((values - mean) ** 2).sum(), values.min(), values.max())
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values seen by another RunningStats.
+        """
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+        return self
+
+    def variance(self, ddof=0):
+        """
+        Variance of the values seen so far (nan when there are not more than ddof values).
+        """
+        return self.m2 / (self.count - ddof) if self.count > ddof else np.nan
+
+    def std(self, ddof=0):
+        """
+        Standard deviation of the values seen so far.
+        """
+        return np.sqrt(self.variance(ddof))
+
+
+class QuantileSketch:
+    def __init__(self, bins=10000, lower=0.0, upper=1.0):
+        """
+        Fixed-size histogram sketch of a stream of values in [lower, upper], for approximate quantiles in
+        constant memory. Quantiles are interpolated inside a bin, so their error is below one bin width.
+        Values outside the range are counted in the first or last bin. Sketches with the same bins can
+        be merged.
+        """
+        self.bins = bins
+        self.lower = lower
+        self.upper = upper
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        """
+        Adds a batch of values. NaN values are ignored.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        positions = ((values - self.lower) / (self.upper - self.lower) * self.bins).astype(np.int64)
+        self.counts += np.bincount(np.clip(positions, 0, self.bins - 1), minlength=self.bins)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values seen by another sketch with the same bins.
+        """
+        if (other.bins, other.lower, other.upper) != (self.bins, self.lower, self.upper):
+            raise ValueError("Only sketches with the same bins can be merged")
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate q-th quantile(s) of the values seen so far, q in [0, 1].
+        """
+        q = np.asarray(q, dtype=float)
+        total = self.counts.sum()
+        if total == 0:
+            return np.full(q.shape, np.nan)[()]
+
+        cumulative = np.cumsum(self.counts)
+        target = q * total
+        bin_index = np.minimum(np.searchsorted(cumulative, target, side='left'), self.bins - 1)
+        below = cumulative[bin_index] - self.counts[bin_index]
+        fraction = np.clip((target - below) / np.maximum(self.counts[bin_index], 1), 0.0, 1.0)
+        width = (self.upper - self.lower) / self.bins
+        return (self.lower + (bin_index + fraction) * width)[()]
+
+
+def band_statistics(csv_file, start=START, stop=STOP, bins=10000):
+    """
+    Streams a flattened coherence CSV one band at a time and collects the running statistics and the
+    quantile sketch of the coherence values (upper triangle) of every band.
+    Returns a dictionary mapping each band name to its (RunningStats, QuantileSketch).
+    """
+    statistics = {}
+    for band, matrix in iter_band_matrices(csv_file, start, stop):
+        upper = matrix[np.triu_indices(matrix.shape[0], k=1)]
+        running, sketch = statistics.setdefault(band, (RunningStats(), QuantileSketch(bins)))
+        running.update(upper)
+        sketch.update(upper)
+    return statistics